@@ -0,0 +1,249 @@
+import asyncio
+import datetime
+import re
+from typing import List
+
+from catalogue import BrandRecord, ProductRecord
+from models.price import Price
+from browser_profiles import PROFILE_DIR, has_consent, profile_path, save_consent
+from dedup import ScannedToday
+from metrics import timed, timer
+from parsing import PageParser
+from network_rules import NetworkFilter
+from page_elements import PageElements
+from rate_limits import RateLimiter
+from readiness import PageReadiness, PAGE_ATTEMPTS, PRODUCT, SEARCH, retry_delay
+from recording import har_route_options
+from playwright.async_api import async_playwright
+from screenshots import (
+    OutputFormat,
+    ScreenshotPipeline,
+    clip_region,
+    screenshot_storage,
+)
+
+
+class AsyncScanner(PageElements, PageParser):
+    """
+    Scanner built on the async Playwright API.
+    Searches go through one search page, one at a time, but the product
+    pages they find are scanned concurrently on a pool of pages, so a slow
+    product page only holds up itself.
+    """
+
+    def __init__(
+        self,
+        brand: BrandRecord,
+        limit: int = 3,
+        headless: bool = False,
+        concurrency: int = 4,
+        har_mode: str = None,
+        profile_dir: str = PROFILE_DIR,
+        screenshot_workers: int = 2,
+        screenshot_dir: str = None,
+        screenshot_output: OutputFormat = None,
+        scanned: ScannedToday = None,
+    ):
+        super().__init__(brand=brand, limit=limit, scanned=scanned)
+        self.headless = headless
+        self.concurrency = max(concurrency, 1)
+        self.har_mode = har_mode
+        self.profile_dir = profile_dir
+        self.profile = None
+        self.readiness = PageReadiness(brand)
+        self.network_filter = NetworkFilter(brand, persistent=profile_dir is not None)
+        self.limiter = RateLimiter(brand, max_concurrency=self.concurrency)
+        self.prices = []
+        self.screenshots = ScreenshotPipeline(
+            workers=screenshot_workers,
+            max_pending=self.concurrency * 2,
+            storage=screenshot_storage(screenshot_dir),
+            output=screenshot_output,
+        )
+
+        self.pw = None
+        self.browser = None
+        self.context = None
+        self.page = None
+        self.pages = asyncio.Queue()
+        self.search_lock = asyncio.Lock()
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def start(self):
+        """
+        Launch the browser, accept the cookie notice and open the page pool
+        :return: self
+        """
+        self.pw = await async_playwright().start()
+
+        # All the pages share one context so they all get the consent cookie
+        prefs = self.network_filter.firefox_user_prefs()
+        if self.profile_dir is not None:
+            self.profile = profile_path(self.brand, self.profile_dir)
+            self.context = await self.pw.firefox.launch_persistent_context(
+                self.profile, headless=self.headless, firefox_user_prefs=prefs
+            )
+        else:
+            self.browser = await self.pw.firefox.launch(
+                headless=self.headless, firefox_user_prefs=prefs
+            )
+            self.context = await self.browser.new_context()
+        if self.har_mode is not None:
+            await self.context.route_from_har(
+                **har_route_options(self.brand, self.har_mode)
+            )
+        await self.network_filter.async_attach(self.context)
+        self.limiter.attach(self.context)
+        if self.context.pages:
+            self.page = self.context.pages[0]
+        else:
+            self.page = await self.context.new_page()
+
+        # A persistent profile remembers the cookie notice was accepted
+        if not has_consent(self.profile, await self.context.cookies()):
+            await self.page.goto(self.brand.start_url)
+            cookies = await self.context.cookies()
+            if await self.brand.async_dismiss_cookie_notice(self.page):
+                save_consent(self.profile, cookies, await self.context.cookies())
+
+        for _ in range(self.concurrency):
+            self.pages.put_nowait(await self.context.new_page())
+
+        return self
+
+    async def close(self):
+        if self.screenshots is not None:
+            await asyncio.to_thread(self.screenshots.close)
+            self.screenshots = None
+
+        # Closing the context is what writes out a recording, and the
+        # profile's cache and cookies
+        if self.context is not None:
+            await self.context.close()
+            self.context = None
+        if self.browser is not None:
+            await self.browser.close()
+            self.browser = None
+        if self.pw is not None:
+            await self.pw.stop()
+            self.pw = None
+
+    @timed("search")
+    async def search(self, product: ProductRecord) -> List[Price]:
+        """
+        Search for products and get their prices
+        :param product:
+        :return:
+        """
+        if self.remaining(product) == 0:
+            return []
+
+        search_url = self.brand.search_url_for(product.search_term)
+        if search_url is not None:
+            # Results can be loaded directly, so any page in the pool will do
+            # and searches don't need to queue for the search page.
+            page = await self.pages.get()
+            try:
+                await self.async_navigate(page, search_url, SEARCH)
+                main_by_role = page.get_by_role("main").or_(page.locator("body")).last
+                prices = self.parse_price_urls(
+                    await main_by_role.inner_html(), page.url, product
+                )
+            finally:
+                self.pages.put_nowait(page)
+
+            await asyncio.gather(*[self.scan_product_page(price) for price in prices])
+            return prices
+
+        # There is only one search page, so searches queue up here while
+        # the product pages of earlier searches carry on in the pool.
+        async with self.search_lock:
+            self.current_search_term = product.search_term
+            if self.page.url == "about:blank":
+                async with self.limiter.async_slot():
+                    await self.page.goto(self.brand.start_url)
+
+            search_input = self.page.get_by_placeholder(
+                re.compile("search|find|looking", re.IGNORECASE)
+            )
+            search_input = search_input.first
+            await search_input.fill(self.current_search_term)
+            previous_url = self.page.url
+            async with self.limiter.async_slot():
+                await search_input.press("Enter")
+                await self.readiness.async_wait(self.page, SEARCH, previous_url)
+
+            # Get product URLS
+            prices = await self.get_price_urls(product)
+
+        await asyncio.gather(*[self.scan_product_page(price) for price in prices])
+        return prices
+
+    async def async_navigate(self, page, url: str, stage: str):
+        for attempt in range(PAGE_ATTEMPTS):
+            try:
+                async with self.limiter.async_slot():
+                    return await self.readiness.async_goto(page, url, stage)
+            except Exception:
+                if attempt == PAGE_ATTEMPTS - 1:
+                    raise
+                await asyncio.sleep(retry_delay(attempt))
+
+    @timed("get_price_urls")
+    async def get_price_urls(self, product: ProductRecord):
+        if not self.page:
+            raise Exception
+
+        main_by_role = self.page.get_by_role("main").or_(self.page.locator("body")).last
+        return self.parse_price_urls(
+            await main_by_role.inner_html(), self.page.url, product
+        )
+
+    @timed("scan_product_page")
+    async def scan_product_page(self, price: Price):
+        page = await self.pages.get()
+        try:
+            await self.async_navigate(page, price.url, PRODUCT)
+
+            main_element = self.get_main_element(page)
+            details = self.parse_product_details(await main_element.inner_html(), price)
+            price.title = details.title or await page.title()
+            price.unit_price = details.unit_price
+            price.price_per, price.unit = details.price_per, details.unit
+            price.recorded_at = datetime.datetime.now()
+
+            if price.unit_price == 0:
+                self.limiter.parse_failed()
+                return price
+
+            # Scroll before measuring anything, or the boxes will be out of date
+            screenshot_element = self.get_screenshot_element(page)
+            try:
+                await screenshot_element.scroll_into_view_if_needed(timeout=100)
+            except:
+                pass
+
+            # Detect location of images so we can blur them out later
+            # This is for copywright reasons
+            images = []
+            for img in await page.get_by_role("img").all():
+                images.append(await img.bounding_box())
+
+            with timer("screenshot_page"):
+                try:
+                    box = await screenshot_element.bounding_box(timeout=1000)
+                except Exception:
+                    box = None
+                clip = clip_region(box, page.viewport_size)
+                screenshot = await page.screenshot(type="png", clip=clip)
+        finally:
+            self.pages.put_nowait(page)
+
+        # Stamping and uploading don't need the page, so give it back first
+        await self.screenshots.async_submit(price, screenshot, images, clip)
+        return price
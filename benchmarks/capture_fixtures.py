@@ -0,0 +1,44 @@
+"""
+Refresh the saved pages used by the parsing benchmarks.
+Loads the search and product URL of every brand in fixtures/manifest.json
+and saves the inner HTML of the same element the scanner parses.
+
+    python benchmarks/capture_fixtures.py [brand ...]
+
+The expected results in the manifest will need updating afterwards, and
+the baseline re-recording with `python -m pytest benchmarks --benchmark-save`.
+"""
+import json
+import os
+import sys
+
+from playwright.sync_api import sync_playwright
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+def main_html(page) -> str:
+    main_by_role = page.get_by_role("main").or_(page.locator("body")).last
+    return main_by_role.inner_html()
+
+
+def capture(brands: list):
+    with open(os.path.join(FIXTURE_DIR, "manifest.json")) as f:
+        manifest = json.load(f)
+
+    with sync_playwright() as pw:
+        browser = pw.firefox.launch(headless=False)
+        for brand in brands or sorted(manifest):
+            print(f"Capturing {brand}")
+            page = browser.new_page()
+            for name in ("search", "product"):
+                page.goto(manifest[brand][f"{name}_url"])
+                page.wait_for_load_state("networkidle", timeout=180000)
+                with open(os.path.join(FIXTURE_DIR, brand, f"{name}.html"), "w") as f:
+                    f.write(main_html(page))
+            page.close()
+        browser.close()
+
+
+if __name__ == "__main__":
+    capture(sys.argv[1:])
@@ -0,0 +1,205 @@
+"""
+Offline benchmarks for the scanner.
+Run with `python -m pytest benchmarks`. A benchmark fails if its fastest
+run is slower than baseline.json's by more than --benchmark-threshold,
+plus some slack for noise: SPREAD_SLACK times the gap between the
+baseline's median and fastest runs, and at least FLOOR_MS.
+Baselines are machine specific, so record one on the machine the
+benchmarks run on with --benchmark-save, or turn the comparison off with
+--benchmark-no-compare. Benchmarks marked noisy, such as those writing to
+disk, are timed and reported but never compared.
+"""
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+import types
+
+import pytest
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURE_DIR = os.path.join(BENCHMARK_DIR, "fixtures")
+BASELINE_FILE = os.path.join(BENCHMARK_DIR, "baseline.json")
+
+# Slack on top of the threshold, in multiples of how much the baseline's
+# own runs varied, and at least this many milliseconds
+SPREAD_SLACK = 2.0
+FLOOR_MS = 0.01
+
+# Make the project importable without installing it
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+
+# The parser imports the models, which import credentials for the database
+# URL. Nothing offline connects, so a clone without credentials.py gets
+# empty ones.
+try:
+    import credentials
+except ImportError:
+    credentials = types.ModuleType("credentials")
+    credentials.DB_HOST = credentials.DB_NAME = "localhost"
+    credentials.DB_USER = credentials.DB_PASSWORD = ""
+    sys.modules["credentials"] = credentials
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("benchmarks")
+    group.addoption(
+        "--benchmark-save",
+        action="store_true",
+        help="record the results as the new baseline instead of comparing",
+    )
+    group.addoption(
+        "--benchmark-no-compare",
+        action="store_true",
+        help="don't fail benchmarks which are slower than the baseline",
+    )
+    group.addoption(
+        "--benchmark-threshold",
+        type=float,
+        default=1.5,
+        help="fail when a benchmark is this many times slower than its baseline",
+    )
+    group.addoption(
+        "--benchmark-time",
+        type=float,
+        default=0.5,
+        help="minimum number of seconds to spend timing each benchmark",
+    )
+
+
+class Bench:
+    def __init__(self, config):
+        self.config = config
+        self.results = {}
+        self.baseline = {}
+        # Whether the benchmark running now is compared, see the bench fixture
+        self.checked = True
+        self.comparing = not (
+            config.getoption("--benchmark-no-compare")
+            or config.getoption("--benchmark-save")
+        )
+        if os.path.exists(BASELINE_FILE):
+            with open(BASELINE_FILE) as f:
+                self.baseline = json.load(f)
+
+    def __call__(self, name: str, func, *args, **kwargs):
+        """
+        Time func, record its allocations and compare it with the baseline
+        :param name: unique name for the benchmark, used as the baseline key
+        :return: whatever func returns
+        """
+        result = func(*args, **kwargs)
+
+        # Allocations, measured separately as tracing slows everything down
+        tracemalloc.start()
+        func(*args, **kwargs)
+        retained, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        times = []
+        min_time = self.config.getoption("--benchmark-time")
+        started = time.perf_counter()
+        while len(times) < 5 or time.perf_counter() - started < min_time:
+            t = time.perf_counter()
+            func(*args, **kwargs)
+            times.append(time.perf_counter() - t)
+
+        self.results[name] = {
+            "median_ms": statistics.median(times) * 1000,
+            "min_ms": min(times) * 1000,
+            "rounds": len(times),
+            "peak_kib": peak / 1024,
+            "retained_kib": retained / 1024,
+        }
+
+        if self.comparing and self.checked and name in self.baseline:
+            # The fastest run is the one least disturbed by everything else
+            # the machine is doing
+            threshold = self.config.getoption("--benchmark-threshold")
+            baseline = self.baseline[name]
+            slack_ms = max(
+                (baseline["median_ms"] - baseline["min_ms"]) * SPREAD_SLACK, FLOOR_MS
+            )
+            min_ms = self.results[name]["min_ms"]
+            assert min_ms <= baseline["min_ms"] * threshold + slack_ms, (
+                f"{name} took {min_ms:.3f}ms at best, baseline is "
+                f"{baseline['min_ms']:.3f}ms (threshold x{threshold} + "
+                f"{slack_ms:.3f}ms)"
+            )
+
+        return result
+
+
+def pytest_configure(config):
+    config.addinivalue_line(
+        "markers", "noisy: time and report the benchmark, but don't compare it"
+    )
+    config._bench = Bench(config)
+
+
+def pytest_generate_tests(metafunc):
+    # Every benchmark taking a brand runs once per brand with saved pages
+    if "brand" in metafunc.fixturenames:
+        metafunc.parametrize("brand", sorted(load_manifest()))
+
+
+def pytest_terminal_summary(terminalreporter, config):
+    bench = config._bench
+    if not bench.results:
+        return
+
+    terminalreporter.section("benchmarks")
+    terminalreporter.write_line(
+        f"{'Benchmark':<45} {'Median':>10} {'Min':>10} {'Baseline':>10} "
+        f"{'Peak':>10} {'Rounds':>7}"
+    )
+    for name, result in sorted(bench.results.items()):
+        baseline = bench.baseline.get(name, {}).get("median_ms")
+        baseline = f"{baseline:.3f}ms" if baseline is not None else "-"
+        terminalreporter.write_line(
+            f"{name:<45} {result['median_ms']:>8.3f}ms {result['min_ms']:>8.3f}ms "
+            f"{baseline:>10} {result['peak_kib']:>7.0f}KiB {result['rounds']:>7}"
+        )
+
+    if config.getoption("--benchmark-save"):
+        baseline = dict(bench.baseline)
+        baseline.update(bench.results)
+        with open(BASELINE_FILE, "w") as f:
+            json.dump(baseline, f, indent=4, sort_keys=True)
+            f.write("\n")
+        terminalreporter.write_line(f"Baseline saved to {BASELINE_FILE}")
+
+
+@pytest.fixture
+def bench(request):
+    bench = request.config._bench
+    bench.checked = request.node.get_closest_marker("noisy") is None
+    return bench
+
+
+def load_manifest() -> dict:
+    with open(os.path.join(FIXTURE_DIR, "manifest.json")) as f:
+        return json.load(f)
+
+
+@pytest.fixture(scope="session")
+def manifest():
+    return load_manifest()
+
+
+@pytest.fixture(scope="session")
+def fixture_html():
+    """
+    Saved HTML of a brand's search results or product page
+    """
+    cache = {}
+
+    def read(brand: str, page: str) -> str:
+        if (brand, page) not in cache:
+            with open(os.path.join(FIXTURE_DIR, brand, f"{page}.html")) as f:
+                cache[(brand, page)] = f.read()
+        return cache[(brand, page)]
+
+    return read
@@ -0,0 +1,219 @@
+"""
+Compare history queries on the old unpartitioned prices table with the
+monthly partitioned one, on a synthetic dataset in a local Postgres.
+
+    python benchmarks/partitioning.py [--rows 5000000] [--url postgresql://...]
+
+The partitioned layout comes with a new (product_id, seller_id,
+recorded_at) index, so the old table is timed both without it and with
+it, to tell what the index gains from what partitioning does.
+Each layout is loaded into a schema of its own, e.g. bench_flat, which is
+dropped and recreated on every run. The database defaults to the one in
+credentials.py, so point --url at a scratch database rather than
+production.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+from sqlalchemy import create_engine, text
+
+# Make the project importable without installing it
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+BRANDS = 5
+PRODUCTS = 300
+PRICES_PER_PRODUCT = 3
+
+COLUMNS = """
+    id             bigserial,
+    seller_id      integer                 not null,
+    product_id     integer                 not null,
+    title          text                    not null,
+    recorded_at    timestamp default now() not null,
+    unit_price     integer                 not null,
+    price_per      integer                 not null,
+    unit           varchar(3)              not null,
+    screenshot_url varchar(1024),
+    url            varchar(1024)           not null
+"""
+
+# prices as it was before migrations/006_partition_prices.sql
+FLAT = f"""
+create table prices ({COLUMNS}, constraint prices_pk primary key (id));
+{{load}}
+create unique index on prices (seller_id, url, (recorded_at::date));
+"""
+
+# The old table with the history index the partitioned one gets
+FLAT_INDEXED = f"""
+{FLAT}
+create index on prices (product_id, seller_id, recorded_at);
+"""
+
+# prices as database.sql creates it
+PARTITIONED = f"""
+create table prices (
+    {COLUMNS},
+    recorded_on date default current_date not null,
+    constraint prices_pk primary key (id, recorded_on)
+) partition by range (recorded_on);
+do
+$$
+    declare
+        month date;
+    begin
+        for month in
+            select generate_series(date_trunc('month', now() - interval '{{days}} days'),
+                                   date_trunc('month', now()), interval '1 month')
+            loop
+                execute format(
+                    'create table %I partition of prices for values from (%L) to (%L)',
+                    'prices_' || to_char(month, 'YYYY_MM'),
+                    month,
+                    (month + interval '1 month')::date
+                );
+            end loop;
+    end
+$$;
+{{load}}
+create unique index on prices (seller_id, url, recorded_on);
+create index on prices using brin (recorded_at);
+create index on prices (product_id, seller_id, recorded_at);
+"""
+
+# Every product at every brand, PRICES_PER_PRODUCT times a day, for {days} days
+LOAD = f"""
+insert into prices (seller_id, product_id, title, recorded_at, unit_price, price_per,
+                    unit, url{{extra_columns}})
+select brand, product, 'Product ' || product,
+       day + interval '6 hours' + (brand || ' minutes')::interval,
+       (100 + random() * 400)::int, (100 + random() * 900)::int, 'kg',
+       'https://brand' || brand || '.example.com/' || product || '/' || n{{extra_values}}
+from generate_series(current_date - {{days}}, current_date, interval '1 day') as day,
+     generate_series(1, {BRANDS}) as brand,
+     generate_series(1, {PRODUCTS}) as product,
+     generate_series(1, {PRICES_PER_PRODUCT}) as n;
+analyze prices;
+"""
+
+LAYOUTS = ("flat", "flat_indexed", "partitioned")
+
+QUERIES = {
+    # Price history of one product at one brand
+    "history (90 days)": """
+        select recorded_at, unit_price from prices
+        where product_id = 42 and seller_id = 3
+          and recorded_at >= now() - interval '90 days'
+        order by recorded_at
+    """,
+    # Cheapest brand for a product on one day
+    "product on one day": """
+        select seller_id, min(unit_price) from prices
+        where product_id = 42
+          and recorded_at >= current_date - 30 and recorded_at < current_date - 29
+        group by seller_id
+    """,
+    # Everything recorded over a week, e.g. for a rollup
+    "one week": """
+        select count(*), avg(unit_price) from prices
+        where recorded_at >= current_date - 14 and recorded_at < current_date - 7
+    """,
+    # What dedup.ScannedToday loads at the start of each brand
+    "scanned today": {
+        "flat": """
+            select url, product_id from prices
+            where seller_id = 3 and recorded_at >= current_date
+        """,
+        "flat_indexed": """
+            select url, product_id from prices
+            where seller_id = 3 and recorded_at >= current_date
+        """,
+        "partitioned": """
+            select url, product_id from prices
+            where seller_id = 3 and recorded_on = current_date
+        """,
+    },
+}
+
+
+def load(connection, schema: str, days: int):
+    connection.execute(text(f"drop schema if exists {schema} cascade"))
+    connection.execute(text(f"create schema {schema}"))
+    connection.execute(text(f"set search_path to {schema}"))
+
+    if schema == "bench_flat":
+        sql = FLAT.format(
+            load=LOAD.format(days=days, extra_columns="", extra_values="")
+        )
+    elif schema == "bench_flat_indexed":
+        sql = FLAT_INDEXED.format(
+            load=LOAD.format(days=days, extra_columns="", extra_values="")
+        )
+    else:
+        sql = PARTITIONED.format(
+            days=days,
+            load=LOAD.format(
+                days=days,
+                extra_columns=", recorded_on",
+                extra_values=", day::date",
+            ),
+        )
+
+    started = time.monotonic()
+    # Straight to the driver, so the % in format() isn't taken as a parameter
+    with connection.connection.cursor() as cursor:
+        cursor.execute(sql)
+    print(f"Loaded {schema} in {time.monotonic() - started:.1f}s")
+
+
+def time_query(connection, sql: str, rounds: int) -> float:
+    # Once to warm the cache, then the median of the rest
+    connection.execute(text(sql)).fetchall()
+    times = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        connection.execute(text(sql)).fetchall()
+        times.append(time.perf_counter() - started)
+    return statistics.median(times) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=5000000)
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--url", default=None, help="defaults to credentials.py")
+    args = parser.parse_args()
+
+    if args.url is None:
+        from database import DB_URL
+
+        args.url = DB_URL
+
+    days = max(args.rows // (BRANDS * PRODUCTS * PRICES_PER_PRODUCT), 1)
+    engine = create_engine(args.url)
+
+    with engine.connect() as connection:
+        for layout in LAYOUTS:
+            load(connection, f"bench_{layout}", days)
+            connection.commit()
+
+        print(f"{'Query':<22} {'Flat':>10} {'Flat+index':>12} {'Partitioned':>12}")
+        for name, sql in QUERIES.items():
+            results = []
+            for layout in LAYOUTS:
+                connection.execute(text(f"set search_path to bench_{layout}"))
+                query = sql[layout] if isinstance(sql, dict) else sql
+                results.append(time_query(connection, query, args.rounds))
+            print(
+                f"{name:<22} {results[0]:>8.2f}ms {results[1]:>10.2f}ms "
+                f"{results[2]:>10.2f}ms"
+            )
+
+        connection.execute(text("set search_path to public"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Benchmarks for the HTML half of the scanner, run against saved pages
+so they don't need a browser or a network.
+"""
+import pytest
+from bs4 import BeautifulSoup
+
+from catalogue import BrandRecord, ProductRecord
+from models.price import Price
+from parsing import PageParser, parse_html
+
+
+@pytest.fixture
+def product(brand, manifest):
+    return ProductRecord(
+        id=1,
+        name=brand,
+        search_term=manifest[brand]["search_term"],
+        group_code="BENCH",
+        group_name="Benchmark",
+        is_food=True,
+    )
+
+
+@pytest.fixture
+def parser(brand, product):
+    parser = PageParser(
+        brand=BrandRecord(
+            id=1, name=brand, start_url="", wait_method="DOM", class_name=""
+        ),
+        limit=3,
+    )
+    parser.search_terms[product.id] = product.search_term
+    return parser
+
+
+@pytest.fixture
+def price(brand, manifest, product):
+    return Price(url=manifest[brand]["product_url"], product_id=product.id)
+
+
+def test_parse_search_page(bench, brand, fixture_html):
+    html = fixture_html(brand, "search")
+    bs = bench(f"{brand}::parse_html[search]", parse_html, html)
+    assert isinstance(bs, BeautifulSoup)
+
+
+def test_parse_product_page(bench, brand, fixture_html):
+    html = fixture_html(brand, "product")
+    bs = bench(f"{brand}::parse_html[product]", parse_html, html)
+    assert isinstance(bs, BeautifulSoup)
+
+
+def test_get_price_urls(bench, brand, manifest, fixture_html, parser, product):
+    html = fixture_html(brand, "search")
+    search_url = manifest[brand]["search_url"]
+    prices = bench(
+        f"{brand}::get_price_urls", parser.parse_price_urls, html, search_url, product
+    )
+    assert [p.url for p in prices] == manifest[brand]["expected"]["urls"]
+
+
+def test_product_list_item(bench, brand, manifest, fixture_html, parser, product):
+    bs = BeautifulSoup(fixture_html(brand, "search"), "lxml")
+    parser.current_search_term = product.search_term
+    items = bench(f"{brand}::product_list_item", bs.find_all, parser.product_list_item)
+    assert len(items) == manifest[brand]["expected"]["list_items"]
+
+
+def test_get_product_title(bench, brand, manifest, fixture_html, parser, price):
+    bs = parse_html(fixture_html(brand, "product"))
+    title = bench(f"{brand}::get_product_title", parser.parse_product_title, bs, price)
+    assert title == manifest[brand]["expected"]["title"]
+
+
+def test_get_product_price(bench, brand, manifest, fixture_html, parser):
+    bs = parse_html(fixture_html(brand, "product"))
+    unit_price = bench(f"{brand}::get_product_price", parser.parse_product_price, bs)
+    assert unit_price == manifest[brand]["expected"]["unit_price"]
+
+
+def test_get_product_price_weight(bench, brand, manifest, fixture_html, parser):
+    bs = parse_html(fixture_html(brand, "product"))
+    price_per, unit = bench(
+        f"{brand}::get_product_price_weight", parser.parse_product_price_weight, bs
+    )
+    assert price_per == manifest[brand]["expected"]["price_per"]
+    assert unit == manifest[brand]["expected"]["unit"]
+
+
+def test_get_product_details(bench, brand, manifest, fixture_html, parser, price):
+    html = fixture_html(brand, "product")
+    details = bench(
+        f"{brand}::get_product_details", parser.parse_product_details, html, price
+    )
+    expected = manifest[brand]["expected"]
+    assert details.title == expected["title"]
+    assert details.unit_price == expected["unit_price"]
+    assert (details.price_per, details.unit) == (
+        expected["price_per"],
+        expected["unit"],
+    )
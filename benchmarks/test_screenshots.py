@@ -0,0 +1,116 @@
+"""
+Benchmarks for stamping screenshots, on a synthetic product listing with
+lots of product images to blur out.
+"""
+import datetime
+import io
+import random
+
+import pytest
+from PIL import Image, ImageDraw
+
+from screenshots import OutputFormat, ScreenshotJob, load_watermark, stamp_screenshot
+
+VIEWPORT = (1280, 720)
+
+
+def listing_screenshot(columns: int, rows: int, mode: str = "RGB") -> tuple:
+    """
+    A PNG of a grid of product tiles, with a bounding box for each image.
+    Each tile has a badge image overlapping its product image, and some
+    images hang off the edges of the viewport, like a real listing.
+    :param mode: RGBA for a PNG with an alpha channel, like Firefox's
+    :return: (PNG bytes, list of boxes)
+    """
+    rng = random.Random(columns * rows)
+    width, height = VIEWPORT
+    image = Image.new(mode, VIEWPORT, "#FFFFFF")
+    renderer = ImageDraw.Draw(image)
+    boxes = []
+
+    tile_w, tile_h = width / columns, (height + 200) / rows
+    for row in range(rows):
+        for column in range(columns):
+            x, y = column * tile_w + 10, row * tile_h - 100
+            box = {"x": x, "y": y, "width": tile_w - 20, "height": tile_h * 0.6}
+            badge = {"x": x + 5, "y": y + 5, "width": 40, "height": 40}
+            for b in (box, badge):
+                renderer.rectangle(
+                    ((b["x"], b["y"]), (b["x"] + b["width"], b["y"] + b["height"])),
+                    fill=tuple(rng.randrange(256) for _ in range(3)),
+                )
+                boxes.append(b)
+            renderer.text((x, y + tile_h * 0.65), "£1.50 Product", fill="#000000")
+
+    store = io.BytesIO()
+    image.save(store, format="png")
+    return store.getvalue(), boxes
+
+
+@pytest.fixture(scope="module")
+def watermark():
+    return load_watermark()
+
+
+def listing_job(columns: int, rows: int, mode: str = "RGB") -> ScreenshotJob:
+    image, boxes = listing_screenshot(columns, rows, mode)
+    return ScreenshotJob(
+        image=image,
+        boxes=tuple(boxes),
+        url="https://www.example.com/products/123456",
+        recorded_at=datetime.datetime(2023, 11, 1, 12, 30),
+        unit_price=150,
+        price_per=300,
+        unit="kg",
+    )
+
+
+@pytest.mark.parametrize("columns,rows", [(1, 1), (6, 5)])
+def test_stamp_screenshot(bench, watermark, columns, rows):
+    job = listing_job(columns, rows)
+    stamped = bench(
+        f"screenshots::stamp[{len(job.boxes)} images]",
+        stamp_screenshot,
+        job,
+        watermark,
+    )
+    with Image.open(stamped) as result:
+        assert result.format == "JPEG"
+        assert result.width <= 900 and result.height <= 750
+
+
+@pytest.mark.parametrize(
+    "output",
+    [OutputFormat("webp"), OutputFormat("jpeg", max_bytes=24 * 1024)],
+    ids=["webp", "jpeg-24KiB"],
+)
+def test_stamp_screenshot_output(bench, watermark, output):
+    job = listing_job(6, 5)
+    name = (
+        f"{output.format}, {output.max_bytes // 1024}KiB"
+        if output.max_bytes
+        else output.format
+    )
+    stamped = bench(
+        f"screenshots::stamp[{len(job.boxes)} images, {name}]",
+        stamp_screenshot,
+        job,
+        watermark,
+        output,
+    )
+    with Image.open(stamped) as result:
+        assert result.format == output.format.upper()
+    if output.max_bytes:
+        assert stamped.getbuffer().nbytes <= output.max_bytes
+
+
+@pytest.mark.parametrize("output", [OutputFormat("jpeg"), OutputFormat("webp")])
+def test_stamp_screenshot_rgba(watermark, output):
+    job = listing_job(6, 5, mode="RGBA")
+    with Image.open(io.BytesIO(job.image)) as screenshot:
+        assert screenshot.mode == "RGBA"
+
+    stamped = stamp_screenshot(job, watermark, output)
+    with Image.open(stamped) as result:
+        assert result.format == output.format.upper()
+        assert result.mode == "RGB"
@@ -0,0 +1,50 @@
+"""
+Benchmarks for saving screenshots, using local storage so they don't need AWS.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from uuid import uuid4
+
+import pytest
+
+from file_storage import LocalStorage
+
+# Roughly the size of a stamped screenshot
+SCREENSHOT_BYTES = 60 * 1024
+BATCH = 32
+
+
+@pytest.fixture
+def storage(tmp_path):
+    return LocalStorage(tmp_path)
+
+
+@pytest.fixture
+def screenshot():
+    return BytesIO(os.urandom(SCREENSHOT_BYTES))
+
+
+def save_batch(storage, screenshot, workers: int) -> list:
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(storage.save, str(uuid4()) + ".jpg", screenshot)
+            for _ in range(BATCH)
+        ]
+        return [future.result() for future in futures]
+
+
+# How long the disk takes to write files back swings a lot between runs
+@pytest.mark.noisy
+@pytest.mark.parametrize("workers", [1, 4])
+def test_save_batch(bench, storage, screenshot, workers):
+    urls = bench(
+        f"storage::local[{BATCH} files, {workers} workers]",
+        save_batch,
+        storage,
+        screenshot,
+        workers,
+    )
+    assert len(set(urls)) == BATCH
+    assert all(url.startswith("file://") for url in urls)
+    assert os.path.getsize(urls[0][len("file://") :]) == SCREENSHOT_BYTES
@@ -9,6 +9,7 @@ from datetime import datetime
 from product import Category, Product
 from PIL import Image, ImageDraw, ImageFont, ImageFilter
 from file_storage import save_file
+from screenshots import load_watermark
 
 font = ImageFont.truetype(
     font=os.path.join(os.getcwd(), "assets", "B612Mono-Regular.ttf"), size=10
@@ -34,15 +35,9 @@ class Brand:
         self.name = name
         self.start_url = start_url
         self.wait_method = DOM
-        self.watermark = Image.open(
-            os.path.join(os.getcwd(), "assets", "LogoIcon@2x.png")
-        )
-        self.watermark = self.watermark.resize((41, 41))
+        self.watermark = load_watermark()
         self.seller_id = seller_id
 
-    def __del__(self):
-        self.watermark.close()
-
     def set_page(self, page: Page):
         self.page = page
         page.goto(self.start_url)
@@ -0,0 +1,112 @@
+import json
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+
+from catalogue import BrandRecord
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+PROFILE_DIR = os.path.join(os.getcwd(), "profiles")
+
+# Written to a profile once its cookie notice has been accepted, with the
+# cookies accepting it set
+CONSENT_MARKER = ".cookie-consent"
+
+
+def profile_path(brand: BrandRecord, directory: str = None) -> str:
+    """
+    The persistent browser profile for a brand.
+    Its cookies, local storage and HTTP cache survive between scans.
+    :param brand: the brand being scanned
+    :param directory: override for PROFILE_DIR
+    :return: path to the profile directory
+    """
+    path = os.path.join(directory or PROFILE_DIR, brand.slug)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def live_cookies(cookies: list) -> dict:
+    """
+    :param cookies: cookies as BrowserContext.cookies gives them
+    :return: {(domain, name): value} of each one which hasn't expired
+    """
+    now = time.time()
+    return {
+        (cookie["domain"], cookie["name"]): cookie["value"]
+        for cookie in cookies
+        if cookie.get("expires", -1) < 0 or cookie["expires"] > now
+    }
+
+
+def has_consent(path: str, cookies: list) -> bool:
+    """
+    Whether a profile's cookie notice has been accepted and is still
+    accepted, i.e. the cookies accepting it set haven't expired or been
+    cleared since
+    :param path: the profile, None for a fresh one
+    :param cookies: the profile's cookies, from BrowserContext.cookies
+    """
+    if path is None:
+        return False
+
+    try:
+        with open(os.path.join(path, CONSENT_MARKER)) as file:
+            consent = {tuple(key) for key in json.load(file)}
+    except (OSError, ValueError):
+        return False
+
+    return consent <= live_cookies(cookies).keys()
+
+
+def save_consent(path: str, before: list, after: list):
+    """
+    Remember that a profile's cookie notice was accepted
+    :param path: the profile, None for a fresh one
+    :param before: cookies from before the notice was accepted
+    :param after: cookies from after it was accepted
+    """
+    if path is None:
+        return
+
+    # Cookies which were set, or changed, by accepting it
+    before = live_cookies(before)
+    consent = sorted(
+        key for key, value in live_cookies(after).items() if before.get(key) != value
+    )
+    with open(os.path.join(path, CONSENT_MARKER), "w") as file:
+        json.dump(consent, file)
+
+
+@contextmanager
+def brand_lock(brand: BrandRecord):
+    """
+    Stop two processes on this host from scanning a brand at once, as they
+    would both open its profile, which Firefox won't allow, and both write
+    its recording. Released when the process exits, however it exits.
+    Does nothing where there's no fcntl, i.e. Windows.
+    :param brand: the brand about to be scanned
+    :return: context manager giving True if this process has the brand,
+             False if another one is scanning it
+    """
+    if fcntl is None:
+        yield True
+        return
+
+    path = os.path.join(tempfile.gettempdir(), f"sniffer-{brand.slug}.lock")
+    with open(path, "w") as file:
+        try:
+            fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+
+        try:
+            yield True
+        finally:
+            fcntl.flock(file, fcntl.LOCK_UN)
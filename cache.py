@@ -0,0 +1,175 @@
+import functools
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+# Bumped whenever new prices are saved, which makes everything cached
+# before then stale. Saves in other processes, e.g. scan workers, are
+# heard about on CHANGES_CHANNEL once something is watching it, see watch.
+_generation = 0
+_generation_lock = threading.Lock()
+_watcher = None
+
+# Postgres LISTEN/NOTIFY channel told about every commit of new prices
+CHANGES_CHANNEL = "sniffer_prices_changed"
+# Most often to check for notifications
+CHECK_SECONDS = 1.0
+
+
+def generation() -> int:
+    if _watcher is not None:
+        _watcher.check()
+    return _generation
+
+
+def bump_generation():
+    global _generation
+    with _generation_lock:
+        _generation += 1
+
+
+def notify_changed(connection):
+    """
+    Tell every process watching that prices have changed, once the
+    connection's transaction commits. Nothing is sent if it rolls back.
+    """
+    connection.execute(text(f"notify {CHANGES_CHANNEL}"))
+
+
+def watch(engine: Engine):
+    """
+    Bump the generation whenever any process commits new prices to the
+    engine's database, not just this one
+    """
+    global _watcher
+    _watcher = ChangeWatcher(engine)
+
+
+class ChangeWatcher:
+    """
+    Listens on CHANGES_CHANNEL with a connection of its own. There's no
+    thread, notifications are picked up off the socket at most every
+    check_seconds when the generation is asked for. If the connection is
+    lost, notifications may have been missed, so that bumps the generation.
+    """
+
+    def __init__(self, engine: Engine, check_seconds: float = CHECK_SECONDS):
+        self.engine = engine
+        self.check_seconds = check_seconds
+        self.connection = None
+        self.checked = 0.0
+        self.lock = threading.Lock()
+
+    def check(self):
+        with self.lock:
+            now = time.monotonic()
+            if now - self.checked < self.check_seconds:
+                return
+            self.checked = now
+
+            try:
+                if self.connection is None:
+                    self.listen()
+                self.connection.poll()
+                if self.connection.notifies:
+                    self.connection.notifies.clear()
+                    bump_generation()
+            except Exception as e:
+                print(" * Lost track of price changes, cached reports dropped")
+                print(f"     > {str(e)}")
+                self.close()
+                bump_generation()
+
+    def listen(self):
+        # Kept out of the pool, as it's listening for as long as it lives
+        connection = self.engine.raw_connection()
+        connection.detach()
+        connection = connection.dbapi_connection
+        connection.autocommit = True
+        with connection.cursor() as cursor:
+            cursor.execute(f"listen {CHANGES_CHANNEL}")
+        self.connection = connection
+
+    def close(self):
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except Exception:
+                pass
+            self.connection = None
+
+
+class GenerationCache:
+    """
+    LRU cache whose entries expire after ttl seconds, or as soon as the
+    generation changes
+    """
+
+    def __init__(self, maxsize: int = 256, ttl: float = 300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """
+        :return: (True, value) if key is cached and fresh, else (False, None)
+        """
+        current = generation()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                entry_generation, expires, value = entry
+                if entry_generation == current and expires > time.monotonic():
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return True, value
+                del self.entries[key]
+
+            self.misses += 1
+            return False, None
+
+    def put(self, key, value, entry_generation: int):
+        with self.lock:
+            self.entries[key] = (entry_generation, time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+def cached(maxsize: int = 256, ttl: float = 300):
+    """
+    Cache a function's results in a GenerationCache, keyed by its arguments.
+    Results are shared between callers, so should be immutable.
+    """
+
+    def decorator(func):
+        cache = GenerationCache(maxsize=maxsize, ttl=ttl)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            key = (args, tuple(sorted(kwargs.items())))
+            found, value = cache.get(key)
+            if found:
+                return value
+
+            # Taken before running func, so a result computed while new
+            # prices were being saved is never mistaken for a fresh one
+            entry_generation = generation()
+            value = func(*args, **kwargs)
+            cache.put(key, value, entry_generation)
+            return value
+
+        wrapper.cache = cache
+        return wrapper
+
+    return decorator
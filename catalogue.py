@@ -0,0 +1,97 @@
+from dataclasses import dataclass, fields
+from typing import Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, joinedload
+
+from models.brand import Brand, BrandActions
+from models.product import Product
+
+# Every model has to be imported for the relationships between them to work
+import models.price
+
+
+@dataclass(frozen=True, eq=False)
+class BrandRecord(BrandActions):
+    """
+    A brand as it was when the scan started. Unlike Brand it isn't tied to a
+    session, so reading it never queries the database.
+    """
+
+    id: int
+    name: str
+    start_url: str
+    wait_method: str
+    class_name: str
+    logo_url: Optional[str] = None
+    colour_code: Optional[str] = None
+    network_rules: Optional[dict] = None
+    ready_selectors: Optional[dict] = None
+    search_url: Optional[str] = None
+    screenshot_selector: Optional[str] = None
+    rate_limits: Optional[dict] = None
+
+    @classmethod
+    def from_model(cls, brand: Brand) -> "BrandRecord":
+        return cls(**{field.name: getattr(brand, field.name) for field in fields(cls)})
+
+
+@dataclass(frozen=True)
+class ProductRecord:
+    id: int
+    name: str
+    search_term: str
+    group_code: str
+    group_name: str
+    is_food: bool
+
+    @classmethod
+    def from_model(cls, product: Product) -> "ProductRecord":
+        return cls(
+            id=product.id,
+            name=product.name,
+            search_term=product.search_term,
+            group_code=product.group_code,
+            group_name=product.group.name,
+            is_food=product.is_food,
+        )
+
+
+@dataclass(frozen=True)
+class Catalogue:
+    """
+    Everything a run scans, loaded once at the start of the run.
+    It's two queries however many brands and products there are, and
+    holds no sessions, so it can be handed to worker processes as is.
+    """
+
+    brands: Tuple[BrandRecord, ...]
+    products: Tuple[ProductRecord, ...]
+
+    @classmethod
+    def load(cls, engine: Engine) -> "Catalogue":
+        """
+        :param engine: database to read from
+        :return: every brand and every active product
+        """
+        select_products = (
+            select(Product)
+            .options(joinedload(Product.group))
+            .where(Product.active == True)
+            .order_by(Product.id)
+        )
+        with Session(engine) as session:
+            brands = session.scalars(select(Brand).order_by(Brand.id))
+            products = session.scalars(select_products)
+            return cls(
+                brands=tuple(BrandRecord.from_model(brand) for brand in brands),
+                products=tuple(ProductRecord.from_model(p) for p in products),
+            )
+
+    def brand(self, brand_id: int) -> BrandRecord:
+        for brand in self.brands:
+            if brand.id == brand_id:
+                return brand
+
+        raise KeyError(f"No brand with id {brand_id}")
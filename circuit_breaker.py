@@ -0,0 +1,94 @@
+import time
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half open"
+
+# Consecutive failed products before a brand is put aside
+FAILURE_THRESHOLD = 5
+# How long a brand is put aside before it's tried again
+RESET_SECONDS = 300
+# Times a brand can be put aside before it's given up on for the run
+MAX_TRIPS = 3
+
+
+class CircuitBreaker:
+    """
+    Stops scanning a brand whose site is broken, instead of letting every
+    product wait for its pages to time out.
+    After threshold products in a row fail, the breaker opens and the
+    brand is put aside. Once reset_seconds have passed it's half open, and
+    one product is let through to try the site again: if it works the
+    breaker closes and scanning carries on, if not it opens again. After
+    opening max_trips times the brand is given up on for the rest of the run.
+    """
+
+    def __init__(
+        self,
+        threshold: int = FAILURE_THRESHOLD,
+        reset_seconds: float = RESET_SECONDS,
+        max_trips: int = MAX_TRIPS,
+    ):
+        self.threshold = max(threshold, 1)
+        self.reset_seconds = reset_seconds
+        self.max_trips = max_trips
+
+        self.failures = 0
+        self.trips = 0
+        self.opened_at = None
+        self.trying = False
+
+    @property
+    def given_up(self) -> bool:
+        return self.opened_at is not None and self.trips >= self.max_trips
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return CLOSED
+        if self.given_up or self.retry_in() > 0:
+            return OPEN
+        return HALF_OPEN
+
+    def retry_in(self) -> float:
+        """
+        :return: seconds until the breaker is half open, 0 if it's not open
+        """
+        if self.opened_at is None:
+            return 0
+
+        return max(self.opened_at + self.reset_seconds - time.monotonic(), 0)
+
+    def allow(self) -> bool:
+        """
+        Whether to scan the next product
+        """
+        state = self.state
+        if state == CLOSED:
+            return True
+        if state == HALF_OPEN and not self.trying:
+            self.trying = True
+            return True
+        return False
+
+    def succeeded(self):
+        # Products which were already under way when it opened can't close
+        # it, only the one let through once it's half open can
+        if self.opened_at is not None and not self.trying:
+            return
+
+        self.failures = 0
+        self.opened_at = None
+        self.trying = False
+
+    def failed(self):
+        # Products which were already under way when it opened don't count
+        if self.opened_at is not None and not self.trying:
+            return
+
+        self.failures += 1
+        if self.trying or self.failures >= self.threshold:
+            self.trips += 1
+            self.failures = 0
+            self.opened_at = time.monotonic()
+            self.trying = False
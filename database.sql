@@ -10,7 +10,12 @@ create table brands
     wait_method varchar(10)  default 'DOM'::character varying     not null,
     class_name  varchar(100) default 'generic'::character varying not null,
     logo_url    varchar(1024),
-    colour_code varchar(10)
+    colour_code varchar(10),
+    network_rules jsonb,
+    ready_selectors jsonb,
+    search_url  varchar(1024),
+    screenshot_selector varchar(1024),
+    rate_limits jsonb
 );
 
 create table groups
@@ -40,21 +45,108 @@ create table products
 
 create table prices
 (
-    id             bigserial
-        constraint prices_pk
-            primary key,
-    seller_id      integer                 not null
+    id             bigserial                 not null,
+    seller_id      integer                   not null
         constraint prices_brands_id_fk
             references brands,
-    product_id     integer                 not null
+    product_id     integer                   not null
         constraint prices_products_id_fk
             references products,
-    title          text                    not null,
-    recorded_at    timestamp default now() not null,
-    unit_price     integer                 not null,
-    price_per      integer                 not null,
-    unit           varchar(3)              not null,
+    title          text                      not null,
+    recorded_at    timestamp default now()   not null,
+    recorded_on    date default current_date not null,
+    unit_price     integer                   not null,
+    price_per      integer                   not null,
+    unit           varchar(3)                not null,
     screenshot_url varchar(1024),
-    url            varchar(1024)           not null
+    url            varchar(1024)             not null,
+    constraint prices_pk
+        primary key (id, recorded_on),
+    constraint prices_recorded_on_check
+        check (recorded_on = recorded_at::date)
+) partition by range (recorded_on);
+
+create unique index prices_seller_url_day_uindex
+    on prices (seller_id, url, recorded_on);
+
+create index prices_recorded_at_brin
+    on prices using brin (recorded_at);
+
+create index prices_product_seller_recorded_at_index
+    on prices (product_id, seller_id, recorded_at);
+
+--- One partition per month, see partitions.py
+create function prices_create_partition(day date) returns void
+    language plpgsql
+as
+$$
+declare
+    starts date := date_trunc('month', day);
+begin
+    execute format(
+        'create table if not exists %I partition of prices for values from (%L) to (%L)',
+        'prices_' || to_char(starts, 'YYYY_MM'),
+        starts,
+        (starts + interval '1 month')::date
+    );
+end
+$$;
+
+select prices_create_partition(current_date);
+
+--- One row per product, brand and day, see rollups.py
+create table daily_prices
+(
+    product_id     integer        not null
+        constraint daily_prices_products_id_fk
+            references products,
+    seller_id      integer        not null
+        constraint daily_prices_brands_id_fk
+            references brands,
+    day            date           not null,
+    prices         integer        not null,
+    min_unit_price integer        not null,
+    max_unit_price integer        not null,
+    avg_unit_price numeric(12, 2) not null,
+    min_price_per  integer        not null,
+    max_price_per  integer        not null,
+    avg_price_per  numeric(12, 2) not null,
+    constraint daily_prices_pk
+        primary key (product_id, seller_id, day)
+);
+
+create index daily_prices_day_index
+    on daily_prices (day);
+
+--- Work queue for scans, one row per brand, product and day, see scan_jobs.py
+create table scan_jobs
+(
+    id           bigserial
+        constraint scan_jobs_pk
+            primary key,
+    seller_id    integer                      not null
+        constraint scan_jobs_brands_id_fk
+            references brands,
+    product_id   integer                      not null
+        constraint scan_jobs_products_id_fk
+            references products,
+    scan_date    date        default current_date not null,
+    state        varchar(10) default 'pending'    not null
+        constraint scan_jobs_state_check
+            check (state in ('pending', 'claimed', 'done', 'failed')),
+    attempts     integer     default 0            not null,
+    claimed_by   varchar(100),
+    claimed_at   timestamp,
+    heartbeat_at timestamp,
+    finished_at  timestamp,
+    prices       integer,
+    error        text,
+    constraint scan_jobs_seller_product_date_uindex
+        unique (seller_id, product_id, scan_date)
 );
 
+--- Only the jobs which are still to do, so claiming stays quick however
+--- many days of finished jobs there are
+create index scan_jobs_open_index
+    on scan_jobs (scan_date, seller_id, product_id)
+    where state in ('pending', 'claimed');
@@ -0,0 +1,73 @@
+import datetime
+from collections import Counter, defaultdict
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from models.price import Price
+
+
+class ScannedToday:
+    """
+    What a brand has already had scanned today, loaded in one query at the
+    start of its scan. Pages which have already been scanned aren't loaded
+    again, and products with all their prices aren't searched for again,
+    so re-running a scan only does the work that didn't get done.
+    """
+
+    def __init__(self, urls=(), product_ids=()):
+        """
+        :param urls: URLs of the prices already saved today
+        :param product_ids: product id of each of those prices
+        """
+        self.urls = set(urls)
+        self.products = Counter(product_ids)
+        # URLs claimed during this run, by product
+        self.claimed = defaultdict(list)
+
+    @classmethod
+    def load(
+        cls, session: Session, brand_id: int, day: datetime.date = None
+    ) -> "ScannedToday":
+        """
+        :param session: session to query with
+        :param brand_id: the brand about to be scanned
+        :param day: defaults to today. It's this machine's date, not the
+                    database's, as that's what price_writer records prices
+                    under.
+        """
+        day = day or datetime.date.today()
+        rows = session.execute(
+            select(Price.url, Price.product_id).where(
+                Price.seller_id == brand_id, Price.recorded_on == day
+            )
+        ).all()
+        return cls(
+            urls=[row.url for row in rows], product_ids=[row.product_id for row in rows]
+        )
+
+    def seen(self, url: str) -> bool:
+        return url in self.urls
+
+    def remaining(self, product_id: int, limit: int) -> int:
+        """
+        How many more prices a product needs today
+        """
+        return max(limit - self.products[product_id], 0)
+
+    def claim(self, url: str, product_id: int):
+        """
+        Mark a URL as scanned, so nothing else in this run scans it
+        """
+        self.urls.add(url)
+        self.products[product_id] += 1
+        self.claimed[product_id].append(url)
+
+    def release(self, product_id: int):
+        """
+        Forget the URLs claimed for a product during this run, because its
+        prices weren't saved and it's going to be tried again
+        """
+        for url in self.claimed.pop(product_id, ()):
+            self.urls.discard(url)
+            self.products[product_id] -= 1
@@ -1,12 +1,173 @@
+import os
+import random
+import threading
+import time
+from abc import ABC, abstractmethod
 from io import BytesIO
+
 import boto3
-from credentials import (
-    AWS_ACCESS_KEY,
-    AWS_SECRET_KEY,
-    AWS_S3_BUCKET,
-    AWS_S3_SCREENSHOT_DIR,
-    AWS_S3_PUBLIC_PATH,
-)
+from botocore.config import Config
+
+from metrics import timed
+
+# Seconds to wait before the first retry, doubled for each one after that
+RETRY_BACKOFF = 0.5
+
+
+class StorageBackend(ABC):
+    """
+    Somewhere to keep screenshots.
+    Backends are shared by every thread in a process, so save must be
+    thread safe. Subclasses implement put.
+    """
+
+    def __init__(self, attempts: int = 3):
+        """
+        :param attempts: how many times to try each file before giving up
+        """
+        self.attempts = max(attempts, 1)
+
+    @abstractmethod
+    def put(self, name: str, data: bytes, content_type: str = None) -> str:
+        """
+        Store one file
+        :param name: the name of the file, including extension
+        :param data: contents of the file
+        :param content_type: MIME type of the file, if known
+        :return: String containing public URL of file
+        """
+
+    @timed("save_file")
+    def save(self, name: str, file: BytesIO, content_type: str = None) -> str:
+        """
+        Store one file, retrying with backoff if it fails
+        :param name: the name of the file, including extension
+        :param file: BytesIO
+        :param content_type: MIME type of the file, if known
+        :return: String containing public URL of file
+        """
+        data = file.getvalue()
+        for attempt in range(self.attempts):
+            try:
+                return self.put(name, data, content_type)
+            except Exception:
+                if attempt == self.attempts - 1:
+                    raise
+                # Jittered so a burst of failed uploads doesn't retry in step
+                time.sleep(RETRY_BACKOFF * 2**attempt * random.uniform(0.5, 1.5))
+
+
+class S3Storage(StorageBackend):
+    """
+    Saves to an S3 bucket, or anything that speaks the S3 API if an
+    endpoint_url is given.
+    One client, and so one connection pool, is shared by every upload.
+    """
+
+    def __init__(
+        self,
+        bucket: str,
+        directory: str,
+        public_path: str,
+        max_connections: int = 10,
+        attempts: int = 3,
+        **client_options,
+    ):
+        """
+        :param bucket: name of the bucket
+        :param directory: prefix for every key
+        :param public_path: base of the public URLs
+        :param max_connections: size of the connection pool, should be at
+                                least the number of threads uploading
+        :param client_options: passed on to boto3.client, e.g. credentials
+                               and endpoint_url
+        """
+        super().__init__(attempts=attempts)
+        self.bucket = bucket
+        self.directory = directory
+        self.public_path = public_path
+        self.config = Config(max_pool_connections=max_connections)
+        self.client_options = client_options
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        # Clients are thread safe, but creating one isn't
+        with self._lock:
+            if self._client is None:
+                self._client = boto3.session.Session().client(
+                    "s3", config=self.config, **self.client_options
+                )
+        return self._client
+
+    def put(self, name: str, data: bytes, content_type: str = None) -> str:
+        key = f"{self.directory}/{name}"
+        extra = {"ContentType": content_type} if content_type else {}
+        self.client.put_object(Body=data, Bucket=self.bucket, Key=key, **extra)
+        return f"{self.public_path}/{self.bucket}/{key}"
+
+
+class LocalStorage(StorageBackend):
+    """
+    Saves to a directory on disk, for running without AWS
+    """
+
+    def __init__(self, directory: str, public_path: str = None, attempts: int = 1):
+        """
+        :param directory: where to save files, created if it doesn't exist
+        :param public_path: base of the URLs returned, defaults to file://
+        """
+        super().__init__(attempts=attempts)
+        self.directory = os.path.abspath(directory)
+        self.public_path = public_path or f"file://{self.directory}"
+        os.makedirs(self.directory, exist_ok=True)
+
+    def put(self, name: str, data: bytes, content_type: str = None) -> str:
+        with open(os.path.join(self.directory, name), "wb") as f:
+            f.write(data)
+        return f"{self.public_path}/{name}"
+
+
+_storage = None
+_storage_lock = threading.Lock()
+
+
+def s3_from_credentials() -> S3Storage:
+    import credentials
+
+    options = {
+        "aws_access_key_id": credentials.AWS_ACCESS_KEY,
+        "aws_secret_access_key": credentials.AWS_SECRET_KEY,
+    }
+    # Optional, for S3 compatible storage
+    endpoint_url = getattr(credentials, "AWS_S3_ENDPOINT_URL", None)
+    if endpoint_url:
+        options["endpoint_url"] = endpoint_url
+
+    return S3Storage(
+        bucket=credentials.AWS_S3_BUCKET,
+        directory=credentials.AWS_S3_SCREENSHOT_DIR,
+        public_path=credentials.AWS_S3_PUBLIC_PATH,
+        **options,
+    )
+
+
+def get_storage() -> StorageBackend:
+    """
+    The storage used by this process, S3 unless set_storage has been called
+    """
+    global _storage
+    with _storage_lock:
+        if _storage is None:
+            _storage = s3_from_credentials()
+        return _storage
+
+
+def set_storage(storage: StorageBackend):
+    global _storage
+    with _storage_lock:
+        _storage = storage
 
 
 def save_file(name, file: BytesIO) -> str:
@@ -16,13 +177,4 @@ def save_file(name, file: BytesIO) -> str:
     :param file: BytesIO
     :return: String containing public URL of file
     """
-
-    s3_client = boto3.client(
-        "s3", aws_access_key_id=AWS_ACCESS_KEY, aws_secret_access_key=AWS_SECRET_KEY
-    )
-
-    filename = f"{AWS_S3_SCREENSHOT_DIR}/{name}"
-    file.seek(0)
-    s3_client.put_object(Body=file, Bucket=AWS_S3_BUCKET, Key=filename)
-
-    return f"{AWS_S3_PUBLIC_PATH}/{AWS_S3_BUCKET}/{filename}"
+    return get_storage().save(name, file)
@@ -1,30 +1,807 @@
+import argparse
+import asyncio
+import datetime
+import functools
+import itertools
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Tuple
+
 from database import db_engine
 from sqlalchemy.orm import Session
-from sqlalchemy import select
-from models.brand import Brand
-from models.product import Product
-from models.price import Price
+from catalogue import BrandRecord, Catalogue, ProductRecord
+from circuit_breaker import CircuitBreaker, OPEN
+from dedup import ScannedToday
+from metrics import METRICS_DIR, collected, for_brand, metrics, write_metrics
+from partitions import ensure_price_partitions
+from price_writer import PriceWriter
+from profiling import MODES, ProfileOptions, Profiler
 from scanner import Scanner
+from async_scanner import AsyncScanner
+from browser_profiles import PROFILE_DIR, brand_lock
+from screenshots import FORMATS, OutputFormat
+from recording import RECORD, REPLAY
+from rollups import update_daily_prices
+from scan_jobs import JobQueue, plan_run
+from models.scan_job import FAILED
+
+
+def empty_summary(brand: BrandRecord) -> dict:
+    return {
+        "brand": brand.name,
+        "products": 0,
+        "prices": 0,
+        "failures": 0,
+        "seconds": 0.0,
+    }
+
+
+def add_summaries(total: dict, summary: dict) -> dict:
+    if total is None:
+        return summary
+
+    return {
+        key: value if key == "brand" else value + summary[key]
+        for key, value in total.items()
+    }
 
-def start_scan():
-    # Create database session
+
+def load_scanned(brand: BrandRecord) -> ScannedToday:
+    # Only for as long as the query takes, nothing else in a scan needs a session
     with Session(db_engine) as session:
-        # Get all the stuff we'll need
-        select_brands = select(Brand)
-        select_products = select(Product).where(Product.active == True)
-
-        for brand_row in session.execute(select_brands):
-            print(f"Starting brand: {brand_row.Brand.name}")
-            scanner = Scanner(brand=brand_row.Brand, limit=3, headless=False)
-            for product_row in session.execute(select_products):
-                print(f" - Product: {product_row.Product.name}")
+        return ScannedToday.load(session, brand.id)
+
+
+def refresh_rollups(brand: BrandRecord, writer: PriceWriter):
+    try:
+        update_daily_prices(db_engine, brand.id, writer.touched)
+    except Exception as e:
+        print(f" * Something went wrong updating {brand.name} daily prices")
+        print(f"     > {str(e)}")
+
+
+def product_batches(
+    brand: BrandRecord,
+    products: Tuple[ProductRecord, ...],
+    queue: JobQueue = None,
+    claim_size: int = 10,
+):
+    """
+    The products to scan for a brand, in batches of (job, product).
+    Without a queue that's every product in one batch, with no jobs.
+    With one it's whatever this worker manages to claim, a batch at a time
+    until the brand has nothing left to do.
+    """
+    if queue is None:
+        yield [(None, product) for product in products]
+        return
+
+    by_id = {product.id: product for product in products}
+    while True:
+        jobs = queue.claim(brand.id, claim_size)
+        if not jobs:
+            return
+
+        batch = []
+        for job in jobs:
+            if job.product_id in by_id:
+                batch.append((job, by_id[job.product_id]))
+            else:
+                # Made inactive since the run was planned
+                queue.finish(job, FAILED, error="Product is not active")
+        if batch:
+            yield batch
+
+
+def finish_jobs(
+    queue: JobQueue, writer: PriceWriter, scanned: ScannedToday, outcomes: list
+):
+    """
+    Complete the jobs of a batch whose prices have all been saved, and put
+    the rest back to be tried again
+    :param scanned: the brand's ScannedToday, which the jobs put back have
+                    their URLs released from, or their retry would find
+                    nothing left to scan
+    :param outcomes: (job, label, prices, error) of each product in the batch
+    """
+    writer.flush()
+    for job, label, prices, error in outcomes:
+        if error is None and label in writer.failed:
+            error = "Prices couldn't be saved"
+        if error is not None:
+            scanned.release(job.product_id)
+            queue.fail(job, error)
+        else:
+            queue.complete(job, len(prices))
+
+
+def put_aside(brand: BrandRecord, breaker: CircuitBreaker, queue: JobQueue = None):
+    if breaker.given_up:
+        print(f" * Giving up on {brand.name} after {breaker.trips} tries")
+    else:
+        print(f" * Putting {brand.name} aside for {breaker.retry_in():.0f}s")
+
+    # Let other workers have a go at whatever was left
+    if queue is not None:
+        queue.release()
+
+
+@for_brand
+def scan_brand(
+    brand: BrandRecord,
+    products: Tuple[ProductRecord, ...],
+    pages: int = 1,
+    batch_size: int = 200,
+    flush_seconds: float = 30,
+    queue: JobQueue = None,
+    breaker: CircuitBreaker = None,
+    profile: ProfileOptions = None,
+    **scanner_options,
+) -> dict:
+    """
+    Scan every active product for one brand.
+    This is the unit of work for a parallel scan, so it opens its own
+    database connections and browser and must not share either with anything
+    else.
+    :param brand: the brand, from the run's Catalogue
+    :param products: the products to scan, from the run's Catalogue
+    :param pages: number of product pages to scan at once, more than one
+                  switches to the async scanner
+    :param batch_size: save prices once this many are waiting
+    :param flush_seconds: save prices once the oldest has waited this long
+    :param queue: only scan the products this worker can claim jobs for
+    :param breaker: the brand's circuit breaker, if it opens the scan stops
+                    and the products left are returned in the summary's
+                    deferred, or handed back to the queue
+    :param profile: profile the scan, if these options pick this brand
+    :param scanner_options: passed on to the Scanner, i.e. limit, headless,
+                            har_mode, profile_dir and screenshot options
+    :return: dict summarising the scan of this brand
+    """
+    breaker = breaker or CircuitBreaker()
+    profiler = Profiler(brand, profile)
+    if pages > 1:
+        return asyncio.run(
+            scan_brand_async(
+                brand,
+                products,
+                pages,
+                batch_size,
+                flush_seconds,
+                queue,
+                breaker,
+                profiler,
+                **scanner_options,
+            )
+        )
+
+    started = time.monotonic()
+    summary = empty_summary(brand)
+    # Products put aside because the brand's circuit breaker opened
+    summary["deferred"] = []
+
+    # Don't start a browser for a brand another worker has already finished
+    batches = product_batches(brand, products, queue)
+    first = next(batches, None)
+    if first is None:
+        return summary
+
+    scanned = load_scanned(brand)
+
+    print(f"Starting brand: {brand.name}")
+    # Prices are only saved once their screenshots have been uploaded
+    with Scanner(
+        brand=brand, scanned=scanned, **scanner_options
+    ) as scanner, PriceWriter(
+        db_engine,
+        batch_size=batch_size,
+        flush_seconds=flush_seconds,
+        before_flush=scanner.wait_for_screenshots,
+    ) as writer, profiler:
+        for batch in itertools.chain([first], batches):
+            outcomes = []
+            for job, product in batch:
+                if not breaker.allow():
+                    summary["deferred"].append(product)
+                    continue
+
+                label = f"{brand.name}/{product.name}"
+                print(f" - {brand.name} product: {product.name}")
+                summary["products"] += 1
+                try:
+                    prices = scanner.search(product)
+                except Exception as e:
+                    breaker.failed()
+                    summary["failures"] += 1
+                    print(f" * Something went wrong adding {label}")
+                    print(f"     > {str(e)}")
+                    outcomes.append((job, label, [], e))
+                    writer.flush_if_due()
+                    continue
+                finally:
+                    profiler.scanned()
+
+                breaker.succeeded()
+                writer.add(label, prices)
+                outcomes.append((job, label, prices, None))
+
+            if queue is not None:
+                finish_jobs(queue, writer, scanned, outcomes)
+            if summary["deferred"]:
+                put_aside(brand, breaker, queue)
+                break
+
+        print(f" - {brand.name} network: {scanner.network_filter.summary()}")
+        print(f" - {brand.name} pacing: {scanner.limiter.summary()}")
+
+    summary["prices"] = writer.written
+    summary["failures"] += len(writer.failed)
+    refresh_rollups(brand, writer)
+
+    summary["seconds"] = time.monotonic() - started
+    return summary
+
+
+async def scan_brand_async(
+    brand: BrandRecord,
+    products: Tuple[ProductRecord, ...],
+    pages: int = 4,
+    batch_size: int = 200,
+    flush_seconds: float = 30,
+    queue: JobQueue = None,
+    breaker: CircuitBreaker = None,
+    profiler: Profiler = None,
+    **scanner_options,
+) -> dict:
+    """
+    Same as scan_brand, but products are scanned concurrently using up to
+    `pages` browser pages at once.
+    """
+    breaker = breaker or CircuitBreaker()
+    profiler = profiler or Profiler(brand)
+    started = time.monotonic()
+    summary = empty_summary(brand)
+    # Products put aside because the brand's circuit breaker opened
+    summary["deferred"] = []
+
+    # Claiming talks to the database, so it's done off the event loop
+    batches = product_batches(brand, products, queue, claim_size=pages * 2)
+    first = await asyncio.to_thread(next, batches, None)
+    if first is None:
+        return summary
+
+    scanned = load_scanned(brand)
+
+    print(f"Starting brand: {brand.name} ({pages} pages)")
+    # The async scanner waits for screenshots before returning prices
+    writer = PriceWriter(db_engine, batch_size=batch_size, flush_seconds=flush_seconds)
+    async with AsyncScanner(
+        brand=brand, concurrency=pages, scanned=scanned, **scanner_options
+    ) as scanner:
+        # Enough products under way to keep every page busy, but few enough
+        # that the breaker can stop the rest if the site turns out to be broken
+        under_way = asyncio.Semaphore(pages * 2)
+
+        async def scan_product(job, product: ProductRecord):
+            async with under_way:
+                if not breaker.allow():
+                    return job, product, None, None
+                try:
+                    prices = await scanner.search(product)
+                except Exception as e:
+                    breaker.failed()
+                    return job, product, [], e
+
+                breaker.succeeded()
+                return job, product, prices, None
+
+        with writer, profiler:
+            batch = first
+            while batch is not None:
+                outcomes = []
+                tasks = [scan_product(job, product) for job, product in batch]
+                for task in asyncio.as_completed(tasks):
+                    job, product, prices, error = await task
+                    if prices is None:
+                        summary["deferred"].append(product)
+                        continue
+
+                    label = f"{brand.name}/{product.name}"
+                    print(f" - {brand.name} product: {product.name}")
+                    summary["products"] += 1
+                    profiler.scanned()
+                    outcomes.append((job, label, prices, error))
+                    if error is not None:
+                        summary["failures"] += 1
+                        print(f" * Something went wrong adding {label}")
+                        print(f"     > {str(error)}")
+                        writer.flush_if_due()
+                        continue
+
+                    writer.add(label, prices)
+
+                if queue is not None:
+                    await asyncio.to_thread(
+                        finish_jobs, queue, writer, scanned, outcomes
+                    )
+                if summary["deferred"]:
+                    await asyncio.to_thread(put_aside, brand, breaker, queue)
+                    break
+                batch = await asyncio.to_thread(next, batches, None)
+
+        print(f" - {brand.name} network: {scanner.network_filter.summary()}")
+        print(f" - {brand.name} pacing: {scanner.limiter.summary()}")
+
+    summary["prices"] = writer.written
+    summary["failures"] += len(writer.failed)
+    refresh_rollups(brand, writer)
+
+    summary["seconds"] = time.monotonic() - started
+    return summary
+
+
+def scan_brands(
+    brands: Tuple[BrandRecord, ...],
+    products: Tuple[ProductRecord, ...],
+    pages: int = 1,
+    batch_size: int = 200,
+    flush_seconds: float = 30,
+    **scanner_options,
+) -> list:
+    """
+    Scan brands one after the other. A brand whose circuit breaker opens is
+    put aside while the others are scanned, then carries on where it left
+    off, until it's given up on.
+    :return: list of dicts summarising the scan of each brand
+    """
+    breakers = {brand.id: CircuitBreaker() for brand in brands}
+    remaining = {brand.id: products for brand in brands}
+    summaries = {}
+
+    while remaining:
+        waiting = [breakers[brand_id].retry_in() for brand_id in remaining]
+        if min(waiting) > 0:
+            time.sleep(min(waiting))
+
+        for brand in brands:
+            breaker = breakers[brand.id]
+            if brand.id not in remaining or breaker.state == OPEN:
+                continue
+
+            summary = scan_brand(
+                brand,
+                remaining.pop(brand.id),
+                pages,
+                batch_size,
+                flush_seconds,
+                breaker=breaker,
+                **scanner_options,
+            )
+            deferred = summary.pop("deferred")
+            if breaker.given_up:
+                summary["failures"] += len(deferred)
+            elif deferred:
+                remaining[brand.id] = tuple(deferred)
+            summaries[brand.id] = add_summaries(summaries.get(brand.id), summary)
+
+    return list(summaries.values())
+
+
+def drain_jobs(
+    catalogue: Catalogue,
+    day: datetime.date = None,
+    worker_index: int = 0,
+    pages: int = 1,
+    batch_size: int = 200,
+    flush_seconds: float = 30,
+    **scanner_options,
+) -> list:
+    """
+    Work through a day's scan_jobs until there's nothing left this worker
+    can claim. Any number of these can run at once, on any number of hosts.
+    :param catalogue: brands and products, to look up the jobs' ids in
+    :param day: day of the run, defaults to today
+    :param worker_index: where in the list of brands to start, so workers
+                         started together spread out over the brands
+    :param pages: number of product pages to scan at once per brand
+    :param batch_size: save prices once this many are waiting
+    :param flush_seconds: save prices once the oldest has waited this long
+    :param scanner_options: passed on to every Scanner
+    :return: list of dicts summarising what this worker scanned per brand
+    """
+    brands = list(catalogue.brands)
+    if brands:
+        start = worker_index % len(brands)
+        brands = brands[start:] + brands[:start]
+
+    summaries = {}
+    breakers = {brand.id: CircuitBreaker() for brand in brands}
+    with JobQueue(db_engine, day) as queue:
+        while True:
+            scanned_any = False
+            for brand in brands:
+                breaker = breakers[brand.id]
+                if breaker.state == OPEN:
+                    continue
+
                 try:
-                    prices = scanner.search(product_row.Product)
-                    session.add_all(prices)
-                    session.commit()
+                    with brand_lock(brand) as locked:
+                        # Another worker on this host has the brand, and will
+                        # see its jobs through
+                        if not locked:
+                            continue
+                        summary = scan_brand(
+                            brand,
+                            catalogue.products,
+                            pages,
+                            batch_size,
+                            flush_seconds,
+                            queue,
+                            breaker,
+                            **scanner_options,
+                        )
+                    # Deferred jobs have already gone back to the queue
+                    del summary["deferred"]
                 except Exception as e:
-                    print(f" * Something went wrong adding {brand_row.Brand.name}/{product_row.Product.name}")
+                    # Let other workers have a go at whatever was left
+                    queue.release()
+                    print(f" * Something went wrong scanning {brand.name}")
                     print(f"     > {str(e)}")
+                    summary = empty_summary(brand)
+                    summary["failures"] = 1
+
+                if summary["products"] or summary["failures"]:
+                    scanned_any = scanned_any or summary["products"] > 0
+                    summaries[brand.name] = add_summaries(
+                        summaries.get(brand.name), summary
+                    )
+
+            # Another pass picks up jobs put back for a retry. Once there's
+            # nothing else to do, wait for put aside brands to be tried again.
+            if scanned_any:
+                continue
+            waiting = [
+                breaker.retry_in()
+                for breaker in breakers.values()
+                if breaker.state == OPEN and not breaker.given_up
+            ]
+            if not waiting:
+                break
+            time.sleep(min(waiting))
+
+        progress = queue.progress()
+        print(f"Jobs for {queue.day}: {progress}")
+
+    return list(summaries.values())
+
+
+def print_summary(summaries: list, seconds: float):
+    print("")
+    print("Scan complete")
+    print(f"{'Brand':<20} {'Products':>8} {'Prices':>8} {'Failures':>8} {'Time':>9}")
+    for summary in sorted(summaries, key=lambda s: s["brand"]):
+        print(
+            f"{summary['brand']:<20} {summary['products']:>8} {summary['prices']:>8} "
+            f"{summary['failures']:>8} {summary['seconds']:>8.1f}s"
+        )
+
+    print(
+        f"{'Total':<20} {sum(s['products'] for s in summaries):>8} "
+        f"{sum(s['prices'] for s in summaries):>8} "
+        f"{sum(s['failures'] for s in summaries):>8} {seconds:>8.1f}s"
+    )
+
+
+def report_metrics(directory: str, summaries: list):
+    if directory is None:
+        return
+
+    try:
+        print(f"Metrics written to {write_metrics(directory, summaries)}")
+    except OSError as e:
+        print(" * Couldn't write metrics")
+        print(f"     > {str(e)}")
+
+
+def start_scan(
+    parallel: bool = False,
+    workers: int = None,
+    pages: int = 1,
+    batch_size: int = 200,
+    flush_seconds: float = 30,
+    metrics_dir: str = METRICS_DIR,
+    **scanner_options,
+):
+    """
+    Scan every brand.
+    In parallel mode each brand is scanned in its own worker process, so
+    the run takes as long as the slowest brand rather than the sum of them.
+    :param parallel: scan brands in separate processes
+    :param workers: max number of worker processes, defaults to one per brand
+    :param pages: number of product pages each brand scans at once
+    :param batch_size: save prices once this many are waiting
+    :param flush_seconds: save prices once the oldest has waited this long
+    :param metrics_dir: where to write the run's metrics, None not to
+    :param scanner_options: passed on to every Scanner, i.e. limit, headless,
+                            har_mode, profile_dir and screenshot options, and
+                            profile on to every scan_brand
+    """
+    started = time.monotonic()
+    metrics.take()
+    ensure_price_partitions(db_engine)
+
+    # Workers are given the catalogue rather than each querying for it
+    catalogue = Catalogue.load(db_engine)
+    print(
+        f"Scanning {len(catalogue.products)} products at "
+        f"{len(catalogue.brands)} brands"
+    )
+
+    summaries = []
+    if not parallel:
+        summaries = scan_brands(
+            catalogue.brands,
+            catalogue.products,
+            pages,
+            batch_size,
+            flush_seconds,
+            **scanner_options,
+        )
+    else:
+        # Playwright and psycopg2 don't survive a fork, so always spawn
+        # fresh interpreters for the workers.
+        with ProcessPoolExecutor(
+            max_workers=workers or len(catalogue.brands) or 1,
+            mp_context=multiprocessing.get_context("spawn"),
+        ) as executor:
+            futures = {
+                executor.submit(
+                    collected,
+                    scan_brands,
+                    (brand,),
+                    catalogue.products,
+                    pages,
+                    batch_size,
+                    flush_seconds,
+                    **scanner_options,
+                ): brand
+                for brand in catalogue.brands
+            }
+            for future in as_completed(futures):
+                try:
+                    result, worker_metrics = future.result()
+                    summaries.extend(result)
+                    metrics.merge(worker_metrics)
+                except Exception as e:
+                    print(f" * Worker for {futures[future].name} failed")
+                    print(f"     > {str(e)}")
+                    summary = empty_summary(futures[future])
+                    summary["failures"] = 1
+                    summaries.append(summary)
+
+    print_summary(summaries, time.monotonic() - started)
+    report_metrics(metrics_dir, summaries)
+
+
+def start_jobs(
+    day: datetime.date = None,
+    parallel: bool = False,
+    workers: int = None,
+    pages: int = 1,
+    batch_size: int = 200,
+    flush_seconds: float = 30,
+    metrics_dir: str = METRICS_DIR,
+    **scanner_options,
+):
+    """
+    Plan a day's run in scan_jobs, unless it already is, then work through
+    it. Run this on as many hosts as you like to share out the run, and
+    again after a crash to pick up where it left off.
+    :param day: day of the run, defaults to today
+    :param parallel: work through the jobs with several processes
+    :param workers: number of worker processes, defaults to one per brand
+    :param pages: number of product pages each brand scans at once
+    :param batch_size: save prices once this many are waiting
+    :param flush_seconds: save prices once the oldest has waited this long
+    :param metrics_dir: where to write the run's metrics, None not to
+    :param scanner_options: passed on to every Scanner
+    """
+    started = time.monotonic()
+    metrics.take()
+    ensure_price_partitions(db_engine)
+
+    catalogue = Catalogue.load(db_engine)
+    day = day or datetime.date.today()
+    print(f"Planned {plan_run(db_engine, catalogue, day)} new jobs for {day}")
+
+    summaries = {}
+    if not parallel:
+        results = [
+            drain_jobs(
+                catalogue, day, 0, pages, batch_size, flush_seconds, **scanner_options
+            )
+        ]
+    else:
+        results = []
+        workers = workers or len(catalogue.brands) or 1
+        # Playwright and psycopg2 don't survive a fork, so always spawn
+        # fresh interpreters for the workers.
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+        ) as executor:
+            futures = [
+                executor.submit(
+                    collected,
+                    drain_jobs,
+                    catalogue,
+                    day,
+                    index,
+                    pages,
+                    batch_size,
+                    flush_seconds,
+                    **scanner_options,
+                )
+                for index in range(workers)
+            ]
+            for future in as_completed(futures):
+                try:
+                    result, worker_metrics = future.result()
+                    results.append(result)
+                    metrics.merge(worker_metrics)
+                except Exception as e:
+                    # Its jobs go stale and another worker picks them up
+                    print(" * Worker failed")
+                    print(f"     > {str(e)}")
+
+    for result in results:
+        for summary in result:
+            summaries[summary["brand"]] = add_summaries(
+                summaries.get(summary["brand"]), summary
+            )
+
+    print_summary(list(summaries.values()), time.monotonic() - started)
+    report_metrics(metrics_dir, list(summaries.values()))
+
 
 if __name__ == "__main__":
-    start_scan()
+    parser = argparse.ArgumentParser(description="Scan supermarket prices")
+    parser.add_argument(
+        "--parallel", action="store_true", help="scan each brand in its own process"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=None, help="max number of worker processes"
+    )
+    parser.add_argument(
+        "--limit", type=int, default=3, help="max prices to record per product"
+    )
+    parser.add_argument("--headless", action="store_true", help="hide the browser")
+    parser.add_argument(
+        "--pages", type=int, default=1, help="product pages to scan at once per brand"
+    )
+    recording = parser.add_mutually_exclusive_group()
+    recording.add_argument(
+        "--record",
+        action="store_const",
+        const=RECORD,
+        dest="har_mode",
+        help="save every page the browsers load to recordings/",
+    )
+    recording.add_argument(
+        "--replay",
+        action="store_const",
+        const=REPLAY,
+        dest="har_mode",
+        help="serve every page from recordings/ instead of the network",
+    )
+    parser.add_argument(
+        "--fresh-profile",
+        action="store_const",
+        const=None,
+        default=PROFILE_DIR,
+        dest="profile_dir",
+        help="don't reuse the saved browser profiles in profiles/",
+    )
+    parser.add_argument(
+        "--screenshot-dir",
+        default=None,
+        help="save screenshots to this directory instead of S3",
+    )
+    parser.add_argument(
+        "--screenshot-format",
+        choices=sorted(FORMATS),
+        default="jpeg",
+        help="image format to save screenshots in",
+    )
+    parser.add_argument(
+        "--screenshot-quality",
+        type=int,
+        default=None,
+        help="screenshot quality from 1 to 100, defaults depend on the format",
+    )
+    parser.add_argument(
+        "--screenshot-max-kb",
+        type=int,
+        default=None,
+        help="lower the quality of screenshots larger than this",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=200,
+        help="save prices once this many are waiting",
+    )
+    parser.add_argument(
+        "--flush-seconds",
+        type=float,
+        default=30,
+        help="save prices once the oldest has waited this long",
+    )
+    parser.add_argument(
+        "--jobs",
+        action="store_true",
+        help="work through the day's scan_jobs, shared with any other workers",
+    )
+    parser.add_argument(
+        "--scan-date",
+        type=datetime.date.fromisoformat,
+        default=None,
+        help="day of the run to work on with --jobs, defaults to today",
+    )
+    parser.add_argument(
+        "--profile",
+        default=None,
+        metavar="BRAND",
+        help="profile the scan of this brand, or of every brand with "
+        "--profile-products",
+    )
+    parser.add_argument(
+        "--profile-products",
+        type=int,
+        default=None,
+        help="only profile the first this many products of each brand profiled",
+    )
+    parser.add_argument(
+        "--profile-mode",
+        choices=MODES,
+        default=MODES[0],
+        help="sample every thread for a flame graph, or cProfile the scan",
+    )
+    parser.add_argument(
+        "--metrics-dir",
+        default=METRICS_DIR,
+        help="where to write the run's Prometheus metrics and JSON report",
+    )
+    args = parser.parse_args()
+
+    profile = None
+    if args.profile is not None or args.profile_products is not None:
+        profile = ProfileOptions(
+            brand=args.profile, products=args.profile_products, mode=args.profile_mode
+        )
+
+    if args.jobs:
+        run = functools.partial(start_jobs, day=args.scan_date)
+    else:
+        run = start_scan
+
+    run(
+        parallel=args.parallel,
+        workers=args.workers,
+        limit=args.limit,
+        headless=args.headless,
+        pages=args.pages,
+        batch_size=args.batch_size,
+        flush_seconds=args.flush_seconds,
+        metrics_dir=args.metrics_dir,
+        profile=profile,
+        har_mode=args.har_mode,
+        profile_dir=args.profile_dir,
+        screenshot_dir=args.screenshot_dir,
+        screenshot_output=OutputFormat(
+            format=args.screenshot_format,
+            quality=args.screenshot_quality,
+            max_bytes=args.screenshot_max_kb and args.screenshot_max_kb * 1024,
+        ),
+    )
@@ -0,0 +1,370 @@
+"""
+Per brand, per stage timings of a scan, so a slow night can be pinned on
+page loads, parsing, screenshots, uploads or the database.
+
+Stages are timed with the timed decorator, or the timer context manager,
+and labelled with the brand being scanned, see for_brand. Every timing goes
+into a histogram with Prometheus' buckets, and a bounded sample of them is
+kept for the percentiles in the run report. Stages which raise are counted
+as errors as well as timed.
+
+Each process records into its own Metrics. Worker processes hand theirs
+back with collected, to be merged into the parent's with merge, and the
+parent writes the lot out with write_metrics: a Prometheus text file for
+node_exporter's textfile collector, and a JSON report with p50/p95/p99.
+"""
+import datetime
+import functools
+import inspect
+import json
+import math
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+METRICS_DIR = os.path.join(os.getcwd(), "metrics")
+PROMETHEUS_FILE = "sniffer.prom"
+
+# Upper bounds in seconds, from a quick DOM query up to a page load timing out
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+# Timings kept per brand and stage for the percentiles
+MAX_SAMPLES = 2000
+PERCENTILES = (50, 95, 99)
+
+current_brand = ContextVar("current_brand", default="")
+
+
+class Histogram:
+    """
+    Timings of one stage for one brand.
+    The bucket counts are exact. Percentiles come from a uniform sample of
+    up to MAX_SAMPLES timings, so they're estimates once there are more.
+    """
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.samples = []
+
+    def observe(self, seconds: float):
+        self.count += 1
+        self.sum += seconds
+
+        for index, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                break
+        else:
+            index = len(BUCKETS)
+        self.buckets[index] += 1
+
+        # Reservoir sampling, so every timing is as likely to be kept
+        if len(self.samples) < MAX_SAMPLES:
+            self.samples.append(seconds)
+        else:
+            slot = random.randrange(self.count)
+            if slot < MAX_SAMPLES:
+                self.samples[slot] = seconds
+
+    def merge(self, other: "Histogram"):
+        total = self.count + other.count
+        if len(self.samples) + len(other.samples) > MAX_SAMPLES:
+            # Keep each side's share of the sample in line with its count
+            mine = round(MAX_SAMPLES * self.count / total)
+            mine = min(max(mine, MAX_SAMPLES - len(other.samples)), len(self.samples))
+            self.samples = random.sample(self.samples, mine) + random.sample(
+                other.samples, min(MAX_SAMPLES - mine, len(other.samples))
+            )
+        else:
+            self.samples = self.samples + other.samples
+
+        self.buckets = [a + b for a, b in zip(self.buckets, other.buckets)]
+        self.count = total
+        self.sum += other.sum
+
+    def percentile(self, percent: float) -> float:
+        """
+        Nearest rank percentile of the sampled timings
+        :param percent: 0 to 100
+        :return: seconds, 0 if nothing was timed
+        """
+        if not self.samples:
+            return 0.0
+
+        ordered = sorted(self.samples)
+        rank = math.ceil(percent / 100 * len(ordered))
+        return ordered[min(max(rank, 1), len(ordered)) - 1]
+
+
+class Metrics:
+    """
+    Histograms of stage timings and counters, keyed by brand.
+    Thread safe, as screenshots are stamped and saved on worker threads.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        # (stage, brand): Histogram
+        self.histograms = {}
+        # (name, brand): count
+        self.counters = {}
+
+    def observe(self, stage: str, seconds: float, brand: str = None):
+        """
+        Record how long one run of a stage took
+        :param stage: what was timed
+        :param seconds: how long it took
+        :param brand: name of the brand, defaults to the one being scanned
+        """
+        key = (stage, current_brand.get() if brand is None else brand)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    def count(self, name: str, amount: int = 1, brand: str = None):
+        """
+        Add to a counter
+        :param name: what's counted, e.g. prices_saved
+        :param amount: how many to add
+        :param brand: name of the brand, defaults to the one being scanned
+        """
+        key = (name, current_brand.get() if brand is None else brand)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def merge(self, other: "Metrics"):
+        """
+        Add in what another process recorded
+        """
+        with self.lock:
+            self.started = min(self.started, other.started)
+            for key, histogram in other.histograms.items():
+                if key in self.histograms:
+                    self.histograms[key].merge(histogram)
+                else:
+                    self.histograms[key] = histogram
+            for key, amount in other.counters.items():
+                self.counters[key] = self.counters.get(key, 0) + amount
+
+    def take(self) -> "Metrics":
+        """
+        Hand over everything recorded so far and start again from nothing
+        :return: what was recorded
+        """
+        taken = Metrics()
+        with self.lock:
+            taken.started = self.started
+            taken.histograms, self.histograms = self.histograms, {}
+            taken.counters, self.counters = self.counters, {}
+            self.started = time.time()
+        return taken
+
+    def __getstate__(self):
+        with self.lock:
+            return {
+                "started": self.started,
+                "histograms": self.histograms,
+                "counters": self.counters,
+            }
+
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def prometheus(self) -> str:
+        """
+        :return: everything recorded in the Prometheus text format
+        """
+        lines = [
+            "# HELP sniffer_stage_seconds Time taken by each stage of a scan",
+            "# TYPE sniffer_stage_seconds histogram",
+        ]
+        with self.lock:
+            histograms = sorted(self.histograms.items())
+            counters = sorted(self.counters.items())
+
+        for (stage, brand), histogram in histograms:
+            labels = f'stage="{stage}",brand="{escape(brand)}"'
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ("+Inf",), histogram.buckets):
+                cumulative += count
+                lines.append(
+                    f'sniffer_stage_seconds_bucket{{{labels},le="{bound}"}} '
+                    f"{cumulative}"
+                )
+            lines.append(f"sniffer_stage_seconds_sum{{{labels}}} {histogram.sum}")
+            lines.append(f"sniffer_stage_seconds_count{{{labels}}} {histogram.count}")
+
+        names = sorted(set(name for (name, _), _ in counters))
+        for name in names:
+            lines.append(f"# TYPE sniffer_{name}_total counter")
+            for (counter, brand), count in counters:
+                if counter == name:
+                    lines.append(
+                        f'sniffer_{name}_total{{brand="{escape(brand)}"}} {count}'
+                    )
+
+        lines.append("# TYPE sniffer_last_run_timestamp_seconds gauge")
+        lines.append(f"sniffer_last_run_timestamp_seconds {time.time():.0f}")
+        return "\n".join(lines) + "\n"
+
+    def report(self) -> dict:
+        """
+        :return: count, total time and percentiles in milliseconds of every
+                 stage, for all brands together and for each brand
+        """
+        with self.lock:
+            histograms = dict(self.histograms)
+            counters = dict(self.counters)
+
+        overall = {}
+        for (stage, _), histogram in histograms.items():
+            if stage not in overall:
+                overall[stage] = Histogram()
+            overall[stage].merge(histogram)
+
+        brands = {}
+        for (stage, brand), histogram in sorted(histograms.items()):
+            brands.setdefault(brand, {"stages": {}, "counters": {}})
+            brands[brand]["stages"][stage] = summarise(histogram)
+        for (name, brand), count in sorted(counters.items()):
+            brands.setdefault(brand, {"stages": {}, "counters": {}})
+            brands[brand]["counters"][name] = count
+
+        return {
+            "started": datetime.datetime.fromtimestamp(self.started).isoformat(),
+            "finished": datetime.datetime.now().isoformat(),
+            "stages": {
+                stage: summarise(histogram)
+                for stage, histogram in sorted(overall.items())
+            },
+            "brands": brands,
+        }
+
+
+def escape(label: str) -> str:
+    return label.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def summarise(histogram: Histogram) -> dict:
+    summary = {
+        "count": histogram.count,
+        "total_seconds": round(histogram.sum, 3),
+    }
+    for percent in PERCENTILES:
+        summary[f"p{percent}_ms"] = round(histogram.percentile(percent) * 1000, 1)
+    return summary
+
+
+# What this process has recorded
+metrics = Metrics()
+
+
+@contextmanager
+def timer(stage: str):
+    """
+    Time the body of a with statement as a stage of the scan
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        metrics.count(f"{stage}_errors")
+        raise
+    finally:
+        metrics.observe(stage, time.perf_counter() - started)
+
+
+def timed(stage: str):
+    """
+    Time every call of a function, or coroutine function, as a stage of
+    the scan
+    :param stage: name to record it under
+    """
+
+    def decorator(function):
+        if inspect.iscoroutinefunction(function):
+
+            @functools.wraps(function)
+            async def wrapper(*args, **kwargs):
+                with timer(stage):
+                    return await function(*args, **kwargs)
+
+        else:
+
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with timer(stage):
+                    return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def for_brand(function):
+    """
+    Label everything timed during a call with the name of the brand it's
+    given first. Threads started with the context copied, and asyncio
+    tasks, keep the label.
+    """
+
+    @functools.wraps(function)
+    def wrapper(brand, *args, **kwargs):
+        token = current_brand.set(brand.name)
+        try:
+            return function(brand, *args, **kwargs)
+        finally:
+            current_brand.reset(token)
+
+    return wrapper
+
+
+def collected(function, *args, **kwargs):
+    """
+    Call a function in a worker process, and hand back what it recorded
+    along with its result. Whatever the process recorded before is dropped,
+    as pool processes are reused.
+    :return: (result, Metrics)
+    """
+    metrics.take()
+    try:
+        result = function(*args, **kwargs)
+    except Exception:
+        metrics.take()
+        raise
+    return result, metrics.take()
+
+
+def write_metrics(directory: str = METRICS_DIR, summaries: list = None) -> str:
+    """
+    Write out everything recorded in this process: a Prometheus text file,
+    which is replaced every run, and a JSON report named after the run
+    :param directory: where to write them
+    :param summaries: the run's summary of each brand, added to the report
+    :return: path of the JSON report
+    """
+    os.makedirs(directory, exist_ok=True)
+    report = metrics.report()
+    if summaries is not None:
+        report["summaries"] = summaries
+
+    # Written under another name then moved into place, so the collector
+    # never reads half a file
+    prometheus_path = os.path.join(directory, PROMETHEUS_FILE)
+    with open(prometheus_path + ".tmp", "w") as file:
+        file.write(metrics.prometheus())
+    os.replace(prometheus_path + ".tmp", prometheus_path)
+
+    started = datetime.datetime.fromtimestamp(metrics.started)
+    report_path = os.path.join(directory, f"run-{started:%Y%m%d-%H%M%S}.json")
+    with open(report_path, "w") as file:
+        json.dump(report, file, indent=2, default=str)
+
+    return report_path
@@ -0,0 +1,5 @@
+--- Per-brand request blocking rules, see network_rules.py
+--- e.g. {"allow": ["sainsburys-groceries.co.uk"], "block_types": ["image"]}
+
+alter table brands
+    add network_rules jsonb;
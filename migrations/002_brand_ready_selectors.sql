@@ -0,0 +1,5 @@
+--- Per-brand page readiness selectors, see readiness.py
+--- e.g. {"search": ["li img"], "product": ["[class*=price]", "h1"]}
+
+alter table brands
+    add ready_selectors jsonb;
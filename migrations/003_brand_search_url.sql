@@ -0,0 +1,7 @@
+--- Per-brand search results URL template, {term} is replaced with the search term
+
+alter table brands
+    add search_url varchar(1024);
+
+update brands set search_url = 'https://www.tesco.com/groceries/en-GB/search?query={term}'
+    where name = 'Tesco' and search_url is null;
@@ -0,0 +1,4 @@
+--- Per-brand selector for the part of a product page to screenshot
+
+alter table brands
+    add screenshot_selector varchar(1024);
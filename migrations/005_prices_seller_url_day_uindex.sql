@@ -0,0 +1,13 @@
+--- One price per brand, URL and day, so scans can be re-run and workers
+--- can't save the same price twice. Any existing duplicates are removed
+--- first, keeping the earliest of each.
+
+delete from prices
+    using prices earlier
+    where prices.seller_id = earlier.seller_id
+      and prices.url = earlier.url
+      and prices.recorded_at::date = earlier.recorded_at::date
+      and prices.id > earlier.id;
+
+create unique index prices_seller_url_day_uindex
+    on prices (seller_id, url, (recorded_at::date));
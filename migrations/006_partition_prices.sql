@@ -0,0 +1,86 @@
+--- Partition prices by month, on a new recorded_on column (recorded_at's date).
+--- Postgres only allows unique indexes on a partitioned table if they
+--- include the partition key as a plain column, so partitioning on
+--- recorded_at itself would mean giving up prices_seller_url_day_uindex.
+--- Existing prices are copied into the new table in one transaction,
+--- which needs enough free disk for a second copy of the table.
+
+begin;
+
+alter table prices rename to prices_unpartitioned;
+alter index prices_pk rename to prices_unpartitioned_pk;
+alter index prices_seller_url_day_uindex rename to prices_unpartitioned_seller_url_day_uindex;
+
+create table prices
+(
+    id             bigint default nextval('prices_id_seq') not null,
+    seller_id      integer                                 not null
+        constraint prices_brands_id_fk
+            references brands,
+    product_id     integer                                 not null
+        constraint prices_products_id_fk
+            references products,
+    title          text                                    not null,
+    recorded_at    timestamp default now()                 not null,
+    recorded_on    date default current_date               not null,
+    unit_price     integer                                 not null,
+    price_per      integer                                 not null,
+    unit           varchar(3)                              not null,
+    screenshot_url varchar(1024),
+    url            varchar(1024)                           not null,
+    constraint prices_pk
+        primary key (id, recorded_on),
+    constraint prices_recorded_on_check
+        check (recorded_on = recorded_at::date)
+) partition by range (recorded_on);
+
+create function prices_create_partition(day date) returns void
+    language plpgsql
+as
+$$
+declare
+    starts date := date_trunc('month', day);
+begin
+    execute format(
+        'create table if not exists %I partition of prices for values from (%L) to (%L)',
+        'prices_' || to_char(starts, 'YYYY_MM'),
+        starts,
+        (starts + interval '1 month')::date
+    );
+end
+$$;
+
+do
+$$
+    begin
+        perform prices_create_partition(month::date)
+        from generate_series(
+            date_trunc('month', coalesce((select min(recorded_at) from prices_unpartitioned), now())),
+            date_trunc('month', now()) + interval '1 month',
+            interval '1 month'
+        ) as month;
+    end
+$$;
+
+insert into prices (id, seller_id, product_id, title, recorded_at, recorded_on, unit_price,
+                    price_per, unit, screenshot_url, url)
+select id, seller_id, product_id, title, recorded_at, recorded_at::date, unit_price,
+       price_per, unit, screenshot_url, url
+from prices_unpartitioned;
+
+--- Indexes are quicker to build once the data is in
+create unique index prices_seller_url_day_uindex
+    on prices (seller_id, url, recorded_on);
+
+create index prices_recorded_at_brin
+    on prices using brin (recorded_at);
+
+create index prices_product_seller_recorded_at_index
+    on prices (product_id, seller_id, recorded_at);
+
+alter sequence prices_id_seq owned by prices.id;
+drop table prices_unpartitioned;
+
+commit;
+
+analyze prices;
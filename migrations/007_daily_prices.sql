@@ -0,0 +1,25 @@
+--- Daily rollup of prices, kept up to date by each scan. Fill it with
+--- the history from before this migration by running `python rollups.py`
+
+create table daily_prices
+(
+    product_id     integer        not null
+        constraint daily_prices_products_id_fk
+            references products,
+    seller_id      integer        not null
+        constraint daily_prices_brands_id_fk
+            references brands,
+    day            date           not null,
+    prices         integer        not null,
+    min_unit_price integer        not null,
+    max_unit_price integer        not null,
+    avg_unit_price numeric(12, 2) not null,
+    min_price_per  integer        not null,
+    max_price_per  integer        not null,
+    avg_price_per  numeric(12, 2) not null,
+    constraint daily_prices_pk
+        primary key (product_id, seller_id, day)
+);
+
+create index daily_prices_day_index
+    on daily_prices (day);
@@ -0,0 +1,33 @@
+--- Work queue for scans, one row per brand, product and day, see scan_jobs.py
+
+create table scan_jobs
+(
+    id           bigserial
+        constraint scan_jobs_pk
+            primary key,
+    seller_id    integer                      not null
+        constraint scan_jobs_brands_id_fk
+            references brands,
+    product_id   integer                      not null
+        constraint scan_jobs_products_id_fk
+            references products,
+    scan_date    date        default current_date not null,
+    state        varchar(10) default 'pending'    not null
+        constraint scan_jobs_state_check
+            check (state in ('pending', 'claimed', 'done', 'failed')),
+    attempts     integer     default 0            not null,
+    claimed_by   varchar(100),
+    claimed_at   timestamp,
+    heartbeat_at timestamp,
+    finished_at  timestamp,
+    prices       integer,
+    error        text,
+    constraint scan_jobs_seller_product_date_uindex
+        unique (seller_id, product_id, scan_date)
+);
+
+--- Only the jobs which are still to do, so claiming stays quick however
+--- many days of finished jobs there are
+create index scan_jobs_open_index
+    on scan_jobs (scan_date, seller_id, product_id)
+    where state in ('pending', 'claimed');
@@ -0,0 +1,5 @@
+--- Per-brand page load pacing, see rate_limits.py
+--- e.g. {"per_second": 0.5, "max_concurrency": 2}
+
+alter table brands
+    add rate_limits jsonb;
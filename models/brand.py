@@ -1,31 +1,29 @@
 from database import Base
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from sqlalchemy import String, func
+from sqlalchemy.dialects.postgresql import JSONB
 from typing import Optional, List
+from urllib.parse import quote
 import re
 from playwright.sync_api import Page
+from playwright.async_api import Page as AsyncPage
 
 DOM = "domcontentloaded"
 NETWORK = "networkidle"
 
 
-class Brand(Base):
+class BrandActions:
     # This class contains all the functionality and _should_ work on each
     # website, however there are some things which need specific targeting
     # in which case the class can be extended and methods overridden to
     # make it work.
+    # It's shared by the Brand model and catalogue.BrandRecord, the copy
+    # of it that scans use, so only relies on the columns below.
 
-    __tablename__ = "brands"
-
-    id: Mapped[int] = mapped_column(primary_key=True)
-    name: Mapped[str] = mapped_column(String(100))
-    start_url: Mapped[str] = mapped_column(String(1024))
-    wait_method: Mapped[str] = mapped_column(String(10))
-    class_name: Mapped[str] = mapped_column(String(100))
-    logo_url: Mapped[Optional[str]] = mapped_column(String(100))
-    colour_code: Mapped[Optional[str]] = mapped_column(String(10))
-
-    prices: Mapped[List["Price"]] = relationship(back_populates="seller")
+    @property
+    def slug(self) -> str:
+        # Safe to use as a file name
+        return re.sub(r"[^a-z0-9]+", "-", self.name.lower()).strip("-")
 
     @property
     def wait_method_setting(self):
@@ -34,16 +32,77 @@ class Brand(Base):
 
         return DOM
 
-    def dismiss_cookie_notice(self, page: Page):
+    def search_url_for(self, search_term: str) -> Optional[str]:
+        """
+        The URL of the results page for a search term
+        :param search_term:
+        :return: the URL, or None if the search form has to be used instead
+        """
+        if not self.search_url:
+            return None
+
+        return self.search_url.replace("{term}", quote(search_term))
+
+    def dismiss_cookie_notice(self, page: Page, timeout: float = 10000) -> bool:
+        """
+        Accept the cookie notice if there is one
+        :param page:
+        :param timeout: how long to wait for the notice to appear, in ms
+        :return: True if a notice was accepted
+        """
         try:
             cookie_button = page.get_by_role("button").filter(
                 has_text=re.compile("allow|accept", re.IGNORECASE)
             )
-            cookie_button.wait_for()
             cookie_button = cookie_button.first
+            cookie_button.wait_for(timeout=timeout)
             cookie_button.hover()
             cookie_button.click()
             page.wait_for_load_state("domcontentloaded")
+            return True
         except:
             # If there's no cookie notice... we don't care
-            pass
+            return False
+
+    async def async_dismiss_cookie_notice(
+        self, page: AsyncPage, timeout: float = 10000
+    ) -> bool:
+        try:
+            cookie_button = page.get_by_role("button").filter(
+                has_text=re.compile("allow|accept", re.IGNORECASE)
+            )
+            cookie_button = cookie_button.first
+            await cookie_button.wait_for(timeout=timeout)
+            await cookie_button.hover()
+            await cookie_button.click()
+            await page.wait_for_load_state("domcontentloaded")
+            return True
+        except:
+            # If there's no cookie notice... we don't care
+            return False
+
+
+class Brand(BrandActions, Base):
+    __tablename__ = "brands"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    name: Mapped[str] = mapped_column(String(100))
+    start_url: Mapped[str] = mapped_column(String(1024))
+    wait_method: Mapped[str] = mapped_column(String(10))
+    class_name: Mapped[str] = mapped_column(String(100))
+    logo_url: Mapped[Optional[str]] = mapped_column(String(100))
+    colour_code: Mapped[Optional[str]] = mapped_column(String(10))
+    # Merged over network_rules.DEFAULT_NETWORK_RULES
+    network_rules: Mapped[Optional[dict]] = mapped_column(JSONB)
+    # Selectors which must all exist before a page is read, keyed by stage
+    # e.g. {"product": ["[class*=price]", "h1"]}, see readiness.py
+    ready_selectors: Mapped[Optional[dict]] = mapped_column(JSONB)
+    # Results page for a search, with {term} where the search term goes
+    # e.g. https://www.tesco.com/groceries/en-GB/search?query={term}
+    search_url: Mapped[Optional[str]] = mapped_column(String(1024))
+    # Part of a product page to screenshot, defaults to the main element
+    screenshot_selector: Mapped[Optional[str]] = mapped_column(String(1024))
+    # Merged over rate_limits.DEFAULT_RATE_LIMITS, e.g. {"per_second": 0.5}
+    rate_limits: Mapped[Optional[dict]] = mapped_column(JSONB)
+
+    prices: Mapped[List["Price"]] = relationship(back_populates="seller")
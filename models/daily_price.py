@@ -0,0 +1,24 @@
+from database import Base
+from sqlalchemy.orm import Mapped, mapped_column, relationship
+from sqlalchemy import ForeignKey, Numeric
+from datetime import date
+from decimal import Decimal
+
+
+class DailyPrice(Base):
+    # Summary of a product's prices at one brand on one day, see rollups.py
+    __tablename__ = "daily_prices"
+
+    product_id: Mapped[int] = mapped_column(ForeignKey("products.id"), primary_key=True)
+    seller_id: Mapped[int] = mapped_column(ForeignKey("brands.id"), primary_key=True)
+    day: Mapped[date] = mapped_column(primary_key=True)
+    prices: Mapped[int]
+    min_unit_price: Mapped[int]
+    max_unit_price: Mapped[int]
+    avg_unit_price: Mapped[Decimal] = mapped_column(Numeric(12, 2))
+    min_price_per: Mapped[int]
+    max_price_per: Mapped[int]
+    avg_price_per: Mapped[Decimal] = mapped_column(Numeric(12, 2))
+
+    product: Mapped["Product"] = relationship()
+    seller: Mapped["Brand"] = relationship()
@@ -2,7 +2,7 @@ from database import Base
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from sqlalchemy import String, func, ForeignKey, Text
 from typing import Optional, List
-from datetime import datetime
+from datetime import date, datetime
 
 
 class Price(Base):
@@ -13,6 +13,8 @@ class Price(Base):
     product_id: Mapped[int] = mapped_column(ForeignKey("products.id"))
     title: Mapped[str] = mapped_column(Text)
     recorded_at: Mapped[datetime] = mapped_column(insert_default=func.now())
+    # Always recorded_at's date, prices are partitioned by it
+    recorded_on: Mapped[date] = mapped_column(insert_default=func.current_date())
     unit_price: Mapped[int]
     price_per: Mapped[int]
     unit: Mapped[str] = mapped_column(String(3))
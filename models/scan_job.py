@@ -0,0 +1,29 @@
+from database import Base
+from sqlalchemy.orm import Mapped, mapped_column
+from sqlalchemy import ForeignKey, String, Text, func
+from typing import Optional
+from datetime import date, datetime
+
+PENDING = "pending"
+CLAIMED = "claimed"
+DONE = "done"
+FAILED = "failed"
+
+
+class ScanJob(Base):
+    # One product to scan at one brand on one day, see scan_jobs.py
+    __tablename__ = "scan_jobs"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    seller_id: Mapped[int] = mapped_column(ForeignKey("brands.id"))
+    product_id: Mapped[int] = mapped_column(ForeignKey("products.id"))
+    scan_date: Mapped[date] = mapped_column(insert_default=func.current_date())
+    state: Mapped[str] = mapped_column(String(10), insert_default=PENDING)
+    attempts: Mapped[int] = mapped_column(insert_default=0)
+    # Worker which has the job, a host name and process id
+    claimed_by: Mapped[Optional[str]] = mapped_column(String(100))
+    claimed_at: Mapped[Optional[datetime]]
+    heartbeat_at: Mapped[Optional[datetime]]
+    finished_at: Mapped[Optional[datetime]]
+    prices: Mapped[Optional[int]]
+    error: Mapped[Optional[str]] = mapped_column(Text)
@@ -0,0 +1,191 @@
+from collections import Counter
+from urllib.parse import urlparse
+
+from catalogue import BrandRecord
+
+# Applied to every brand. A brand's network_rules column is merged on top,
+# with its lists added to these ones and its flags replacing these ones.
+DEFAULT_NETWORK_RULES = {
+    # Never needed to read a price or take a screenshot
+    "block_types": [
+        "media",
+        "font",
+        "websocket",
+        "eventsource",
+        "manifest",
+        "texttrack",
+    ],
+    # Hosts (or parts of hosts) which are always blocked
+    "deny": [
+        "doubleclick.net",
+        "googlesyndication.com",
+        "googletagmanager.com",
+        "google-analytics.com",
+        "googleadservices.com",
+        "facebook.net",
+        "connect.facebook",
+        "criteo",
+        "adsrvr.org",
+        "hotjar",
+        "quantummetric",
+        "bat.bing.com",
+        "tiktok",
+        "pinterest",
+        "clarity.ms",
+    ],
+    # Hosts (or parts of hosts) which are always allowed, even if they are
+    # third party or match a deny rule
+    "allow": [],
+    # Block third party requests apart from images and stylesheets, which
+    # product images and screenshots need
+    "block_third_party": True,
+    # Intercepting requests turns off the browser's HTTP cache, so a
+    # persistent profile's cache is never used. A brand which gains more from
+    # a warm cache than from blocking can turn routing off, in which case
+    # Firefox's own tracker and font blocking is used instead, and none of
+    # the rules above are applied.
+    "route": True,
+}
+
+# Used instead of routing when a brand turns it off
+FIREFOX_BLOCKING_PREFS = {
+    "privacy.trackingprotection.enabled": True,
+    "privacy.trackingprotection.socialtracking.enabled": True,
+    "gfx.downloadable_fonts.enabled": False,
+    "media.autoplay.default": 5,
+}
+
+THIRD_PARTY_ALLOWED_TYPES = ("image", "stylesheet")
+
+
+def site_of(host: str) -> str:
+    """
+    Roughly the registrable domain of a host, e.g. www.tesco.com -> tesco.com
+    and groceries.asda.co.uk -> asda.co.uk
+    """
+    labels = (host or "").lower().split(".")
+    if len(labels) > 2 and len(labels[-1]) == 2 and len(labels[-2]) <= 3:
+        return ".".join(labels[-3:])
+    return ".".join(labels[-2:])
+
+
+def network_rules(brand: BrandRecord) -> dict:
+    rules = dict(DEFAULT_NETWORK_RULES)
+    for key, value in (brand.network_rules or {}).items():
+        if isinstance(value, list):
+            rules[key] = rules.get(key, []) + value
+        else:
+            rules[key] = value
+
+    return rules
+
+
+class NetworkFilter:
+    """
+    Route handler which stops a brand's pages downloading things the
+    scanner doesn't need, and keeps count of what it let through.
+    """
+
+    def __init__(self, brand: BrandRecord, persistent: bool = False):
+        """
+        :param brand: the brand whose pages are filtered
+        :param persistent: whether the browser keeps a persistent profile,
+                           the only reason to turn routing off
+        """
+        self.brand = brand
+        self.rules = network_rules(brand)
+        self.site = site_of(urlparse(brand.start_url).hostname)
+        self.routing = bool(self.rules["route"])
+
+        if not self.routing:
+            ignored = sorted(key for key in brand.network_rules if key != "route")
+            if ignored:
+                print(
+                    f" * {brand.name} has routing turned off, so its network "
+                    f"rules aren't applied: {', '.join(ignored)}"
+                )
+            if not persistent:
+                print(
+                    f" * {brand.name} has routing turned off, but without a "
+                    f"persistent profile there's no cache to keep"
+                )
+
+        self.blocked = Counter()
+        self.allowed = Counter()
+        self.allowed_bytes = 0
+
+    def attach(self, context):
+        """
+        Start filtering a sync BrowserContext.
+        Must be called after any other routes are added, so this runs first.
+        """
+        if self.routing:
+            context.route("**/*", self.route)
+        context.on("response", self.on_response)
+
+    async def async_attach(self, context):
+        if self.routing:
+            await context.route("**/*", self.async_route)
+        context.on("response", self.on_response)
+
+    def firefox_user_prefs(self) -> dict:
+        """
+        Preferences to launch Firefox with for this brand
+        """
+        if self.routing:
+            return {}
+
+        return dict(FIREFOX_BLOCKING_PREFS)
+
+    def should_block(self, url: str, resource_type: str) -> bool:
+        host = urlparse(url).hostname or ""
+        if any(allowed in host for allowed in self.rules["allow"]):
+            return False
+
+        if any(denied in host for denied in self.rules["deny"]):
+            return True
+
+        if resource_type in self.rules["block_types"]:
+            return True
+
+        if (
+            self.rules["block_third_party"]
+            and site_of(host) != self.site
+            and resource_type not in THIRD_PARTY_ALLOWED_TYPES
+        ):
+            return True
+
+        return False
+
+    def route(self, route):
+        request = route.request
+        if self.should_block(request.url, request.resource_type):
+            self.blocked[request.resource_type] += 1
+            route.abort()
+        else:
+            # Fall back rather than continue, so a HAR replay still gets it
+            route.fallback()
+
+    async def async_route(self, route):
+        request = route.request
+        if self.should_block(request.url, request.resource_type):
+            self.blocked[request.resource_type] += 1
+            await route.abort()
+        else:
+            await route.fallback()
+
+    def on_response(self, response):
+        self.allowed[response.request.resource_type] += 1
+        try:
+            self.allowed_bytes += int(response.headers.get("content-length", 0))
+        except ValueError:
+            pass
+
+    def summary(self) -> str:
+        # Blocked requests are never downloaded, so only their count is known
+        blocked = ", ".join(f"{t} {n}" for t, n in self.blocked.most_common())
+        return (
+            f"allowed {sum(self.allowed.values())} requests "
+            f"({self.allowed_bytes / 1024 / 1024:.1f}MB), "
+            f"blocked {sum(self.blocked.values())} requests ({blocked or 'none'})"
+        )
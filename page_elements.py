@@ -0,0 +1,17 @@
+class PageElements:
+    """
+    Finds the parts of a page the scanners read and capture.
+    Locators are built the same way in the sync and async Playwright APIs,
+    so both scanners share these. Needs brand, and page for the default.
+    """
+
+    def get_main_element(self, page=None):
+        page = page or self.page
+        main_by_role = page.get_by_role("main").or_(page.locator("body")).last
+        return main_by_role
+
+    def get_screenshot_element(self, page=None):
+        page = page or self.page
+        if self.brand.screenshot_selector:
+            return page.locator(self.brand.screenshot_selector).first
+        return self.get_main_element(page)
@@ -0,0 +1,338 @@
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Optional
+
+from catalogue import BrandRecord, ProductRecord
+from models.price import Price
+from dedup import ScannedToday
+from metrics import timed
+from urllib.parse import urlparse, urljoin
+from bs4 import BeautifulSoup, Tag
+
+MONEY_PATTERN = r"[0-9.]+"
+UNIT_PATTERN = r"\s?(?:per|/|\s)+(each|[01aegiklmorst]+)"
+PRICE_PER_POUNDS_PATTERN = rf"£({MONEY_PATTERN}){UNIT_PATTERN}"
+PRICE_PER_PENNIES_PATTERN = rf"({MONEY_PATTERN})p{UNIT_PATTERN}"
+PRODUCT_LINK_PATTERN = re.compile("product|item", re.IGNORECASE)
+OFFER_PATTERN = re.compile("offer|sponsored", re.IGNORECASE)
+
+
+@dataclass(frozen=True)
+class ProductDetails:
+    """
+    Everything read from a product page, taken from a single snapshot
+    of its main element.
+    """
+
+    title: Optional[str]
+    unit_price: int
+    price_per: int
+    unit: str
+
+
+class SearchTermMatcher:
+    """
+    Everything used to match text and links against one search term,
+    compiled once instead of on every element of a results page.
+    """
+
+    def __init__(self, search_term: str):
+        self.search_term = search_term
+        words = search_term.split(" ")
+
+        # Longest first, as the longer words are the least likely to match
+        # and so rule a string out soonest.
+        self.terms = tuple(
+            sorted(set(word.lower() for word in words), key=len, reverse=True)
+        )
+
+        any_word = "|".join(re.escape(word) for word in words)
+        self.link_pattern = re.compile(rf"product|item|{any_word}", re.IGNORECASE)
+
+        url_words = r"[\w\d-]*".join(re.escape(word.lower()) for word in words)
+        self.url_title_pattern = re.compile(rf"\/([\w-]*{url_words}[\w-]*)[\/-]")
+
+    def contains_search_terms(self, string: str) -> bool:
+        if string is None:
+            return False
+
+        string = string.lower()
+        for term in self.terms:
+            if term not in string:
+                return False
+
+        return True
+
+    def is_product_list_item(self, element: Tag) -> bool:
+        """
+        Return True if the element looks like a product listing
+        :param element: Tag
+        :return: bool
+        """
+        # Must be a list item
+        # Or (for Aldi) some random shit
+        if element.name != "li" and not element.get("data-qa") == "search-results":
+            return False
+
+        # Must contain an image
+        if element.find("img", recursive=True) is None:
+            return False
+
+        # Must contain a link which includes the words product or item
+        # or contains any words from the search query
+        product_link = element.find("a", recursive=True, href=self.link_pattern)
+        if product_link is None:
+            return False
+
+        # Must NOT contain the words 'Offer' or 'Sponsored'
+        offer_text = element.find(recursive=True, string=OFFER_PATTERN)
+        if offer_text is not None:
+            return False
+
+        # Must contain the search term(s) somewhere in the text
+        search_text_element = element.find(
+            recursive=True,
+            string=self.contains_search_terms,
+        )
+        if search_text_element is None:
+            return False
+
+        return True
+
+
+@lru_cache(maxsize=256)
+def search_term_matcher(search_term: str) -> SearchTermMatcher:
+    return SearchTermMatcher(search_term)
+
+
+def parse_html(html: str) -> BeautifulSoup:
+    # Comments get in the way of the string matching, so drop them first
+    return BeautifulSoup(re.sub(r"<!.*?->", "", html), "lxml")
+
+
+class PageParser:
+    """
+    The HTML half of the scanner.
+    Nothing in here touches the browser, so it works just as well on
+    saved pages as it does on live ones.
+    """
+
+    def __init__(
+        self, brand: BrandRecord, limit: int = 3, scanned: ScannedToday = None
+    ):
+        """
+        :param brand: the brand being scanned
+        :param limit: max number of prices to record per product
+        :param scanned: what has already been scanned today, if it should be
+                        skipped
+        """
+        self.brand = brand
+        self.limit = limit
+        self.scanned = scanned
+        self.current_search_term = ""
+        # Prices only have their product's id, so this is how the product
+        # pages find out what was searched for
+        self.search_terms = {}
+
+    def remaining(self, product: ProductRecord) -> int:
+        """
+        How many more prices to record for a product
+        """
+        if self.scanned is None:
+            return self.limit
+
+        return self.scanned.remaining(product.id, self.limit)
+
+    def parse_price_urls(self, html: str, page_url: str, product: ProductRecord):
+        """
+        Find the product page URLs in the HTML of a product listing page
+        :param html: inner HTML of the listing's main element
+        :param page_url: URL of the listing page, used to resolve relative links
+        :param product: the product that was searched for
+        :return: list of new Price objects with only the URL set
+        """
+        current_base_url = urlparse(page_url)
+        self.current_search_term = product.search_term
+        self.search_terms[product.id] = product.search_term
+
+        limit = self.remaining(product)
+        if limit == 0:
+            return []
+
+        matcher = search_term_matcher(product.search_term)
+        bs = BeautifulSoup(html, "lxml")
+        # Leave room for the links to pages which were scanned earlier today
+        product_link_elements = bs.find_all(
+            matcher.is_product_list_item, limit=self.limit + 3 + self.limit - limit
+        )
+
+        new_prices = []
+        for product_element in product_link_elements:
+            if len(new_prices) >= limit:
+                break
+
+            link_tag = product_element.find(
+                "a",
+                recursive=True,
+                href=PRODUCT_LINK_PATTERN,
+            )
+            if link_tag is None:
+                # If we didn't find it, try another method
+                link_tag = product_element.find(
+                    "a",
+                    recursive=True,
+                    attrs={"data-oc-click": "searchProductClick"},
+                )
+                if link_tag is None:
+                    continue
+
+            url = urlparse(link_tag["href"])
+            if url.netloc == "":
+                url = urljoin(
+                    current_base_url.scheme + "://" + current_base_url.netloc, url.path
+                )
+            else:
+                url = link_tag["href"]
+
+            if self.scanned is not None:
+                if self.scanned.seen(url):
+                    continue
+                self.scanned.claim(url, product.id)
+
+            new_prices.append(
+                Price(seller_id=self.brand.id, product_id=product.id, url=url)
+            )
+
+        return new_prices
+
+    def parse_product_details(self, html: str, price: Price) -> ProductDetails:
+        bs = parse_html(html)
+        price_per, unit = self.parse_product_price_weight(bs)
+        return ProductDetails(
+            title=self.parse_product_title(bs, price),
+            unit_price=self.parse_product_price(bs),
+            price_per=price_per,
+            unit=unit,
+        )
+
+    @timed("parse_product_price_weight")
+    def parse_product_price_weight(self, bs: BeautifulSoup):
+        price_tag = bs.find(string=self.string_contains_price_per, recursive=True)
+
+        price = 0
+        unit = ""
+        if price_tag is not None:
+            text = price_tag.get_text()
+            pounds_match = re.compile(PRICE_PER_POUNDS_PATTERN, re.IGNORECASE).search(
+                text
+            )
+            if pounds_match:
+                price, unit = float(pounds_match.group(1)) * 100, pounds_match.group(2)
+            else:
+                pennies_match = re.compile(
+                    PRICE_PER_PENNIES_PATTERN, re.IGNORECASE
+                ).search(text)
+                if pennies_match:
+                    price, unit = float(pennies_match.group(1)), pennies_match.group(2)
+
+            # Conform units to SI units
+            if unit in ("each", "Each", "EACH", "ea"):
+                unit = "Ech"
+            elif unit in ("l", "L", "litre", "liter", "lt", "ltr", "Ltr"):
+                unit = "L"
+            elif unit in ("100g", "100G", "100 grams"):
+                unit = "hg"  # Hectogram (100 grams)
+            elif unit in ("100ml", "100ML", "100 millilitre"):
+                unit = "dL"  # Decilitre (100ml) - not to be confused with decAlitre
+            elif unit in ("KG", "kg", "kilo", "kilogram", "Kilo", "Kilogram"):
+                unit = "kg"
+            else:
+                unit = "?"
+
+        return int(price), unit
+
+    @timed("parse_product_title")
+    def parse_product_title(self, bs: BeautifulSoup, price: Price):
+        """
+        Work out the product title from the product page
+        :param bs: parsed main element of the product page
+        :param price: the price being scanned
+        :return: the title, or None if the page title should be used instead
+        """
+        matcher = search_term_matcher(
+            self.search_terms.get(price.product_id, self.current_search_term)
+        )
+
+        # Try seeing if there is a header which contains the search term
+        title_tag = bs.find(
+            ["h1", "h2", "h3", "h4"], string=matcher.contains_search_terms
+        )
+        if title_tag is not None:
+            return title_tag.get_text()
+
+        # If not, does the URL contain the search term?
+        path = urlparse(price.url).path
+        match = matcher.url_title_pattern.search(path)
+        if match:
+            try:
+                return match.group(1).replace("-", " ").title()
+            except:
+                pass
+
+        return None
+
+    @timed("parse_product_price")
+    def parse_product_price(self, bs: BeautifulSoup):
+        pounds_pattern = re.compile(rf"£({MONEY_PATTERN})\s*$")
+        pennies_pattern = re.compile(rf"({MONEY_PATTERN})p\s*$")
+        price_tag = bs.find(
+            class_=re.compile("price", re.IGNORECASE), recursive=True
+        ).find(string=[pounds_pattern, pennies_pattern])
+
+        price = 0
+
+        if price_tag is not None:
+            price_text = price_tag.get_text()
+            if price_text.startswith("£"):
+                price = float(price_text.lstrip("£")) * 100
+            if price_text.endswith("p"):
+                price = float(price_text.rstrip("p"))
+
+        return int(price)
+
+    def product_list_item(self, element: Tag):
+        """
+        Return True if the element looks like a product listing
+        :param element: Tag
+        :return: bool
+        """
+        if not self.current_search_term:
+            raise Exception
+
+        return search_term_matcher(self.current_search_term).is_product_list_item(
+            element
+        )
+
+    def string_contains_search_terms(self, string: str, search_term: str = None):
+        return search_term_matcher(
+            search_term or self.current_search_term
+        ).contains_search_terms(string)
+
+    def string_contains_price_per(self, string: str):
+        string = string.lstrip("(").rstrip(")")
+        if (
+            not string.startswith("£")
+            and re.compile(rf"{MONEY_PATTERN}p", re.IGNORECASE).search(string) is None
+        ):
+            return False
+
+        pounds_pattern = re.compile(PRICE_PER_POUNDS_PATTERN, re.IGNORECASE)
+        if pounds_pattern.search(string):
+            return True
+
+        pennies_pattern = re.compile(PRICE_PER_PENNIES_PATTERN, re.IGNORECASE)
+        if pennies_pattern.search(string):
+            return True
+
+        return False
@@ -0,0 +1,24 @@
+import datetime
+
+from sqlalchemy import func, select
+from sqlalchemy.engine import Engine
+
+
+def add_months(day: datetime.date, months: int) -> datetime.date:
+    month = day.month - 1 + months
+    return datetime.date(day.year + month // 12, month % 12 + 1, 1)
+
+
+def ensure_price_partitions(engine: Engine, months_ahead: int = 1):
+    """
+    Make sure prices has a partition for this month and the next few, so a
+    scan running over the end of a month has somewhere to save its prices.
+    :param engine: database to check
+    :param months_ahead: number of months after this one to create
+    """
+    today = datetime.date.today()
+    with engine.begin() as connection:
+        for months in range(months_ahead + 1):
+            connection.execute(
+                select(func.prices_create_partition(add_months(today, months)))
+            )
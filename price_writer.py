@@ -0,0 +1,182 @@
+import time
+from datetime import datetime
+from typing import Callable, List
+
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.engine import Engine
+
+from cache import bump_generation, notify_changed
+from metrics import metrics, timed
+from models.price import Price
+
+# Everything but the id, which the database assigns
+PRICE_COLUMNS = (
+    "seller_id",
+    "product_id",
+    "title",
+    "recorded_at",
+    "recorded_on",
+    "unit_price",
+    "price_per",
+    "unit",
+    "screenshot_url",
+    "url",
+)
+
+
+def price_row(price: Price) -> dict:
+    row = {column: getattr(price, column) for column in PRICE_COLUMNS}
+
+    if row["recorded_at"] is None:
+        row["recorded_at"] = datetime.now()
+    if row["recorded_on"] is None:
+        row["recorded_on"] = row["recorded_at"].date()
+
+    return row
+
+
+class PriceWriter:
+    """
+    Buffers scanned prices and saves them in batches, with a multi-row
+    INSERT per batch instead of a transaction and an INSERT ... RETURNING
+    for every price.
+    If a batch fails, each product's prices are retried in a transaction of
+    their own, so a bad row only loses the product it belongs to.
+    """
+
+    def __init__(
+        self,
+        engine: Engine,
+        batch_size: int = 200,
+        flush_seconds: float = 30,
+        before_flush: Callable = None,
+    ):
+        """
+        :param engine: database to write to
+        :param batch_size: flush once this many prices are waiting
+        :param flush_seconds: flush once the oldest waiting price is this old,
+                              checked whenever prices are added, or by
+                              flush_if_due
+        :param before_flush: called before every flush, e.g. to wait for
+                             screenshot URLs
+        """
+        self.engine = engine
+        self.batch_size = max(batch_size, 1)
+        self.flush_seconds = flush_seconds
+        self.before_flush = before_flush
+
+        self.pending = []
+        self.pending_count = 0
+        self.oldest = None
+
+        self.written = 0
+        self.failed = []
+        # (product_id, day) of everything saved, for rollups.update_daily_prices
+        self.touched = set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def add(self, label: str, prices: List[Price]):
+        """
+        Queue one product's prices to be saved
+        :param label: what the prices are, used to report failures
+        :param prices: the prices
+        """
+        if prices:
+            self.pending.append((label, prices))
+            self.pending_count += len(prices)
+            if self.oldest is None:
+                self.oldest = time.monotonic()
+
+        self.flush_if_due()
+
+    def flush_if_due(self) -> int:
+        """
+        Save everything waiting if there's a batch's worth, or it's been
+        waiting long enough. add checks this, and the scan loops call it
+        after a product fails too, so a brand whose products start failing
+        still saves the prices it already has.
+        :return: number of prices saved
+        """
+        if self.due():
+            return self.flush()
+        return 0
+
+    def due(self) -> bool:
+        if self.pending_count >= self.batch_size:
+            return True
+
+        return (
+            self.oldest is not None
+            and time.monotonic() - self.oldest >= self.flush_seconds
+        )
+
+    def flush(self) -> int:
+        """
+        Save everything waiting
+        :return: number of prices saved
+        """
+        if not self.pending:
+            return 0
+
+        if self.before_flush is not None:
+            self.before_flush()
+
+        batch = self.pending
+        self.pending, self.pending_count, self.oldest = [], 0, None
+
+        groups = []
+        for label, prices in batch:
+            try:
+                groups.append((label, [price_row(price) for price in prices]))
+            except Exception as e:
+                self.fail(label, e)
+
+        written = self.written
+        try:
+            self.insert([row for _, rows in groups for row in rows])
+        except Exception:
+            # Find the bad rows by saving each product on its own
+            for label, rows in groups:
+                try:
+                    self.insert(rows)
+                except Exception as e:
+                    self.fail(label, e)
+
+        return self.written - written
+
+    @timed("commit")
+    def insert(self, rows: List[dict]):
+        if not rows:
+            return
+
+        # A price can only be saved once per brand, URL and day, see
+        # prices_seller_url_day_uindex. Anything already saved is left alone,
+        # so a worker re-running a brand can't double up its prices.
+        # The rows returned are counted rather than trusting rowcount, which
+        # doesn't cover every statement when a big batch is split up.
+        with self.engine.begin() as connection:
+            result = connection.execute(
+                insert(Price).on_conflict_do_nothing().returning(Price.id), rows
+            )
+            written = len(result.all())
+            if written:
+                notify_changed(connection)
+        self.written += written
+        metrics.count("prices_saved", written)
+        self.touched.update((row["product_id"], row["recorded_on"]) for row in rows)
+        if written:
+            # Anything reports.py cached is out of date now
+            bump_generation()
+
+    def fail(self, label: str, error: Exception):
+        self.failed.append(label)
+        print(f" * Something went wrong adding {label}")
+        print(f"     > {str(error)}")
+
+    def close(self):
+        self.flush()
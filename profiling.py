@@ -0,0 +1,239 @@
+"""
+Profiles a real scan of one brand, or its first few products, without
+editing any code, see ProfileOptions and main.py's --profile switches.
+
+The sampling profiler looks at every thread's stack every interval and
+writes them as collapsed stacks, one "frame;frame;frame count" line per
+distinct stack, which flamegraph.pl, speedscope and inferno all read.
+Time spent waiting on the browser is cut off at the Playwright call that
+is waiting, under a [playwright] frame, so Python doing real work, such as
+parsing or PIL stamping screenshots, stands out from it. Threads idling on
+a lock or queue aren't counted, nor is an event loop with nothing to run.
+
+The cProfile mode is deterministic instead, with exact call counts, but
+only sees the thread the scan runs on, so not the screenshot workers.
+"""
+import cProfile
+import datetime
+import os
+import sys
+import threading
+from collections import Counter
+from dataclasses import dataclass
+from typing import Optional
+
+from catalogue import BrandRecord
+
+PROFILING_DIR = os.path.join(os.getcwd(), "profiling")
+
+SAMPLE = "sample"
+CPROFILE = "cprofile"
+MODES = (SAMPLE, CPROFILE)
+
+PLAYWRIGHT_DIR = f"{os.sep}playwright{os.sep}"
+# Stacks ending in one of these are a thread with nothing to do
+IDLE_FILES = ("threading.py", "queue.py", "selectors.py")
+
+try:
+    from greenlet import getcurrent as current_greenlet
+except ImportError:
+    current_greenlet = None
+
+
+@dataclass(frozen=True)
+class ProfileOptions:
+    """
+    What to profile. Handed to worker processes as is.
+    """
+
+    # Name of the brand to profile, None for every brand
+    brand: Optional[str] = None
+    # Stop profiling a brand after this many products, None for all of them
+    products: Optional[int] = None
+    mode: str = SAMPLE
+    # Seconds between samples
+    interval: float = 0.005
+    directory: str = PROFILING_DIR
+
+    def wants(self, brand: BrandRecord) -> bool:
+        if self.brand is None:
+            return True
+
+        return self.brand.lower() in (brand.name.lower(), brand.slug)
+
+
+def frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_qualname} ({os.path.basename(code.co_filename)})"
+
+
+def collapse(frame, idle_files: tuple = IDLE_FILES) -> Optional[list]:
+    """
+    The labels of a stack from the outermost frame in, stopping at the
+    first Playwright frame
+    :param frame: the innermost frame
+    :param idle_files: if the innermost frame is in one of these files,
+                       the thread is waiting for something to do
+    :return: labels, or None if the thread is idle
+    """
+    if frame is None or os.path.basename(frame.f_code.co_filename) in idle_files:
+        return None
+
+    stack = []
+    while frame is not None:
+        stack.append(frame)
+        frame = frame.f_back
+    stack.reverse()
+
+    labels = []
+    for frame in stack:
+        if PLAYWRIGHT_DIR in frame.f_code.co_filename:
+            labels.append(f"[playwright] {frame.f_code.co_qualname}")
+            break
+        labels.append(frame_label(frame))
+    return labels
+
+
+class Sampler:
+    """
+    Samples every thread's stack on a thread of its own.
+    Samples are added up over every time it's enabled and disabled. It
+    has the same methods as cProfile.Profile, so either can be used.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self.thread = None
+        self.stopped = threading.Event()
+        self.target = None
+        self.greenlet = None
+
+    def enable(self):
+        """
+        Start sampling, the thread this is called from is the one the scan
+        is running on
+        """
+        if self.thread is not None:
+            return
+
+        self.target = threading.get_ident()
+        # The sync Playwright API waits for the browser on a greenlet of its
+        # own, which leaves the scan's greenlet suspended
+        if current_greenlet is not None:
+            self.greenlet = current_greenlet()
+        self.stopped.clear()
+        self.thread = threading.Thread(
+            target=self.run, name="profile-sampler", daemon=True
+        )
+        self.thread.start()
+
+    def disable(self):
+        if self.thread is None:
+            return
+
+        self.stopped.set()
+        self.thread.join()
+        self.thread = None
+
+    def run(self):
+        names = {}
+        while not self.stopped.wait(self.interval):
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+
+            for ident, frame in sys._current_frames().items():
+                if ident == threading.get_ident():
+                    continue
+                stack = self.stack(ident, frame)
+                if stack is not None:
+                    name = names.get(ident, str(ident))
+                    self.stacks[";".join([name] + stack)] += 1
+            self.samples += 1
+
+    def stack(self, ident: int, frame) -> Optional[list]:
+        if ident != self.target:
+            return collapse(frame)
+
+        # The scan's own thread is never idle, it's waiting on something
+        suspended = self.greenlet is not None and self.greenlet.gr_frame is not None
+        if suspended:
+            stack = collapse(self.greenlet.gr_frame, idle_files=())
+        else:
+            stack = collapse(frame, idle_files=())
+        if stack is None:
+            return None
+        if suspended and not stack[-1].startswith("[playwright]"):
+            stack.append("[playwright]")
+        elif not suspended and frame.f_code.co_name == "select":
+            # An event loop with nothing to run is waiting on the browser
+            stack[-1] = "[playwright] event loop idle"
+        return stack
+
+    def dump_stats(self, path: str):
+        """
+        Save the samples as collapsed stacks
+        """
+        with open(path, "w") as file:
+            for stack, count in sorted(self.stacks.items()):
+                file.write(f"{stack} {count}\n")
+
+
+class Profiler:
+    """
+    Profiles a brand's scan if the options ask for it, otherwise does
+    nothing, so scan_brand can always use one.
+    Profiling starts when the scan of the products starts, and stops
+    either once options.products products have been scanned or when the
+    scan is over.
+    """
+
+    def __init__(self, brand: BrandRecord, options: ProfileOptions = None):
+        self.brand = brand
+        self.options = options
+        self.enabled = options is not None and options.wants(brand)
+        self.products = 0
+        self.profile = None
+
+        if not self.enabled:
+            return
+        if options.mode == CPROFILE:
+            self.profile = cProfile.Profile()
+        else:
+            self.profile = Sampler(options.interval)
+
+    def __enter__(self):
+        if self.enabled:
+            self.profile.enable()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def stop(self):
+        if not self.enabled:
+            return
+
+        self.profile.disable()
+        self.write()
+        self.enabled = False
+
+    def scanned(self):
+        """
+        Count a product as scanned, and stop if that's enough of them
+        """
+        self.products += 1
+        if self.options is not None and self.products == self.options.products:
+            self.stop()
+
+    def write(self):
+        os.makedirs(self.options.directory, exist_ok=True)
+        name = f"{self.brand.slug}-{datetime.datetime.now():%Y%m%d-%H%M%S}"
+        if self.options.mode == CPROFILE:
+            path = os.path.join(self.options.directory, f"{name}.pstats")
+        else:
+            path = os.path.join(self.options.directory, f"{name}.folded")
+        self.profile.dump_stats(path)
+
+        print(f" - {self.brand.name} profile: {path} ({self.products} products)")
@@ -0,0 +1,202 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager, contextmanager
+from urllib.parse import urlparse
+
+from catalogue import BrandRecord
+from network_rules import site_of
+
+# Applied to every brand, with a brand's rate_limits column merged on top
+DEFAULT_RATE_LIMITS = {
+    # Most page loads a second, the pace starts here and never goes above it
+    "per_second": 1.0,
+    # Page loads which can go straight after each other before pacing starts
+    "burst": 3,
+    # Least page loads a second, however badly the site is coping
+    "min_per_second": 0.1,
+    # Most page loads at once, for scanners with more than one page
+    "max_concurrency": 4,
+    # A page load slower than this counts as the site struggling
+    "slow_ms": 15000,
+    # Only slow down once in this long, so one bad moment isn't counted
+    # over and over by every page load that was caught up in it
+    "cooldown_seconds": 5,
+}
+
+# Responses which mean slow down
+OVERLOADED_STATUSES = (429, 503)
+
+
+def rate_limits(brand: BrandRecord) -> dict:
+    limits = dict(DEFAULT_RATE_LIMITS)
+    limits.update(brand.rate_limits or {})
+    return limits
+
+
+class TokenBucket:
+    """
+    Allows rate page loads a second on average, and up to burst at once
+    """
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def reserve(self) -> float:
+        """
+        Take a token, borrowing it if there aren't any, so callers queue up
+        in the order they asked
+        :return: seconds to wait before using it
+        """
+        now = time.monotonic()
+        self.tokens = min(self.tokens + (now - self.updated) * self.rate, self.burst)
+        self.updated = now
+
+        self.tokens -= 1
+        if self.tokens >= 0:
+            return 0
+
+        return -self.tokens / self.rate
+
+
+class RateLimiter:
+    """
+    Paces a brand's page loads, and adapts the pace to how the site copes.
+    Every page load that goes well speeds things up a little, and every
+    sign of trouble, i.e. a 429 or 503, a slow or failed load or a page
+    without a price, halves both the rate and the number of page loads at
+    once (AIMD). So each site settles at about the most it will put up with.
+    Not thread safe, each scanner has its own.
+    """
+
+    def __init__(self, brand: BrandRecord, max_concurrency: int = 1):
+        """
+        :param brand: the brand being scanned
+        :param max_concurrency: pages the scanner can load at once, the
+                                brand's max_concurrency can lower it
+        """
+        self.brand = brand
+        self.limits = rate_limits(brand)
+        self.site = site_of(urlparse(brand.start_url).hostname)
+
+        self.max_rate = self.limits["per_second"]
+        self.min_rate = min(self.limits["min_per_second"], self.max_rate)
+        self.bucket = TokenBucket(self.max_rate, self.limits["burst"])
+
+        self.max_concurrency = max(
+            min(max_concurrency, self.limits["max_concurrency"]), 1
+        )
+        self.concurrency = float(self.max_concurrency)
+        self.active = 0
+        self.condition = None
+
+        self.last_slowed = 0.0
+        self.loads = 0
+        self.slowdowns = 0
+        self.waited = 0.0
+
+    def attach(self, context):
+        """
+        Watch a BrowserContext, sync or async, for responses saying slow down
+        """
+        context.on("response", self.on_response)
+
+    def on_response(self, response):
+        # Only the brand's own pages count, not an ad or consent frame
+        # being throttled by somebody else
+        if (
+            response.status in OVERLOADED_STATUSES
+            and response.request.is_navigation_request()
+            and response.frame.parent_frame is None
+            and site_of(urlparse(response.url).hostname) == self.site
+        ):
+            self.slow_down()
+
+    @contextmanager
+    def slot(self):
+        """
+        Wait for the brand's pace to allow a page load, then time it.
+        For the sync scanner, which only ever loads one page at a time.
+        """
+        wait = self.bucket.reserve()
+        if wait > 0:
+            self.waited += wait
+            time.sleep(wait)
+
+        started = time.monotonic()
+        try:
+            yield
+        except Exception:
+            self.slow_down()
+            raise
+        self.observe(started)
+
+    @asynccontextmanager
+    async def async_slot(self):
+        """
+        Same as slot, but also waits for fewer than the current concurrency
+        limit of page loads to be under way
+        """
+        if self.condition is None:
+            self.condition = asyncio.Condition()
+
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.active < int(self.concurrency))
+            self.active += 1
+
+        try:
+            wait = self.bucket.reserve()
+            if wait > 0:
+                self.waited += wait
+                await asyncio.sleep(wait)
+
+            started = time.monotonic()
+            try:
+                yield
+            except Exception:
+                self.slow_down()
+                raise
+            self.observe(started)
+        finally:
+            async with self.condition:
+                self.active -= 1
+                self.condition.notify_all()
+
+    def observe(self, started: float):
+        self.loads += 1
+        if (time.monotonic() - started) * 1000 > self.limits["slow_ms"]:
+            self.slow_down()
+        else:
+            self.speed_up()
+
+    def speed_up(self):
+        # About one more page at once per round of that many page loads
+        self.concurrency = min(
+            self.concurrency + 1 / self.concurrency, self.max_concurrency
+        )
+        self.bucket.rate = min(self.bucket.rate + self.max_rate / 10, self.max_rate)
+
+    def slow_down(self):
+        now = time.monotonic()
+        if now - self.last_slowed < self.limits["cooldown_seconds"]:
+            return
+
+        self.last_slowed = now
+        self.slowdowns += 1
+        self.concurrency = max(self.concurrency / 2, 1)
+        self.bucket.rate = max(self.bucket.rate / 2, self.min_rate)
+
+    def parse_failed(self):
+        """
+        Count a page without a price as trouble, it's often a bot wall
+        """
+        self.slow_down()
+
+    def summary(self) -> str:
+        return (
+            f"{self.loads} page loads, slowed down {self.slowdowns} times, "
+            f"waited {self.waited:.1f}s, ended at {self.bucket.rate:.2f}/s "
+            f"and {int(self.concurrency)} at once"
+        )
@@ -0,0 +1,190 @@
+import random
+import time
+from collections import deque
+
+from catalogue import BrandRecord
+from metrics import timer
+
+SEARCH = "search"
+PRODUCT = "product"
+
+# All in milliseconds, as that's what Playwright wants
+INITIAL_TIMEOUT = 30000
+MIN_TIMEOUT = 5000
+MAX_TIMEOUT = 60000
+# A server which hasn't started sending a page by now is down or refusing
+# us, so it isn't given the rest of the page's timeout
+COMMIT_TIMEOUT = 10000
+
+# Times each page is tried before giving up, with a jittered wait between
+PAGE_ATTEMPTS = 3
+RETRY_BACKOFF = 1.0
+
+
+def retry_delay(attempt: int) -> float:
+    """
+    Seconds to wait before retrying a page, doubling every attempt.
+    Jittered so pages which failed together don't all retry together.
+    """
+    return RETRY_BACKOFF * 2**attempt * random.uniform(0.5, 1.5)
+
+
+class AdaptiveTimeout:
+    """
+    A timeout based on how long pages have actually taken to be ready,
+    so a hung page is given up on in seconds rather than minutes.
+    """
+
+    def __init__(
+        self,
+        initial: float = INITIAL_TIMEOUT,
+        minimum: float = MIN_TIMEOUT,
+        maximum: float = MAX_TIMEOUT,
+        factor: float = 2,
+        min_samples: int = 5,
+        max_samples: int = 50,
+    ):
+        self.initial = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.factor = factor
+        self.min_samples = min_samples
+        self.samples = deque(maxlen=max_samples)
+
+    @property
+    def timeout(self) -> float:
+        if len(self.samples) < self.min_samples:
+            return self.initial
+
+        ordered = sorted(self.samples)
+        p95 = ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)]
+        return min(max(p95 * self.factor, self.minimum), self.maximum)
+
+    def observe(self, milliseconds: float):
+        self.samples.append(milliseconds)
+
+
+class Navigation:
+    """
+    One page load being waited for, with its deadline.
+    The Playwright calls are the same for sync and async pages, except that
+    an async page's return awaitables, so these return whatever the page
+    does and PageReadiness awaits them or not.
+    """
+
+    def __init__(self, readiness: "PageReadiness", page, stage: str):
+        self.readiness = readiness
+        self.page = page
+        self.stage = stage
+        self.started = time.monotonic()
+        self.timeout = readiness.timeouts[stage].timeout
+
+    def commit(self, url: str = None, previous_url: str = None):
+        """
+        Go to url, or wait for the page to leave previous_url, until the
+        server starts sending the new page
+        """
+        timeout = min(self.timeout, COMMIT_TIMEOUT)
+        if url is not None:
+            return self.page.goto(url, wait_until="commit", timeout=timeout)
+
+        return self.page.wait_for_url(
+            lambda new_url: new_url != previous_url,
+            wait_until="commit",
+            timeout=timeout,
+        )
+
+    def ready_steps(self):
+        """
+        The waits for the page to be ready, one at a time so each one's
+        timeout is whatever is left when it starts
+        """
+        selectors = self.readiness.selectors.get(self.stage)
+        if selectors:
+            for selector in selectors:
+                yield self.page.locator(selector).first.wait_for(
+                    state="attached", timeout=self.remaining()
+                )
+        else:
+            yield self.page.wait_for_load_state(
+                self.readiness.brand.wait_method_setting, timeout=self.remaining()
+            )
+
+    def remaining(self) -> float:
+        return PageReadiness.remaining(self.started, self.timeout)
+
+    def finished(self):
+        self.readiness.timeouts[self.stage].observe(
+            (time.monotonic() - self.started) * 1000
+        )
+
+
+class PageReadiness:
+    """
+    Decides when a page is ready to be read.
+    If the brand has ready_selectors for a stage, the page is ready as soon
+    as all of them are in the DOM. Otherwise it falls back to waiting for
+    the brand's wait_method load state. Either way the wait is bounded by a
+    timeout adapted to this brand's observed page times, and the server has
+    COMMIT_TIMEOUT of that to start responding.
+    """
+
+    def __init__(self, brand: BrandRecord):
+        self.brand = brand
+        self.selectors = brand.ready_selectors or {}
+        self.timeouts = {SEARCH: AdaptiveTimeout(), PRODUCT: AdaptiveTimeout()}
+
+    def goto(self, page, url: str, stage: str):
+        """
+        Navigate to url and wait until it is ready
+        :param page: sync Playwright Page
+        :param url: where to go
+        :param stage: SEARCH or PRODUCT
+        """
+        self.navigate(Navigation(self, page, stage), url=url)
+
+    def wait(self, page, stage: str, previous_url: str = None):
+        """
+        Wait for a navigation that has already been started, e.g. by
+        submitting a form, to be ready
+        :param page: sync Playwright Page
+        :param stage: SEARCH or PRODUCT
+        :param previous_url: URL before the navigation, so the old page isn't
+                             mistaken for the new one
+        """
+        self.navigate(Navigation(self, page, stage), previous_url=previous_url)
+
+    async def async_goto(self, page, url: str, stage: str):
+        await self.async_navigate(Navigation(self, page, stage), url=url)
+
+    async def async_wait(self, page, stage: str, previous_url: str = None):
+        await self.async_navigate(
+            Navigation(self, page, stage), previous_url=previous_url
+        )
+
+    def navigate(
+        self, navigation: Navigation, url: str = None, previous_url: str = None
+    ):
+        if url is not None or previous_url is not None:
+            with timer("page_commit"):
+                navigation.commit(url, previous_url)
+        with timer("page_ready"):
+            for _ in navigation.ready_steps():
+                pass
+        navigation.finished()
+
+    async def async_navigate(
+        self, navigation: Navigation, url: str = None, previous_url: str = None
+    ):
+        if url is not None or previous_url is not None:
+            with timer("page_commit"):
+                await navigation.commit(url, previous_url)
+        with timer("page_ready"):
+            for step in navigation.ready_steps():
+                await step
+        navigation.finished()
+
+    @staticmethod
+    def remaining(started: float, timeout: float) -> float:
+        # Playwright treats 0 as no timeout, so never go below 1ms
+        return max(timeout - (time.monotonic() - started) * 1000, 1)
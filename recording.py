@@ -0,0 +1,43 @@
+import os
+
+from catalogue import BrandRecord
+
+RECORD = "record"
+REPLAY = "replay"
+
+RECORDING_DIR = os.path.join(os.getcwd(), "recordings")
+
+
+def recording_path(brand: BrandRecord, directory: str = None) -> str:
+    """
+    Where the archive of a brand's scan session lives
+    :param brand: the brand being scanned
+    :param directory: override for RECORDING_DIR
+    :return: path to a HAR zip archive
+    """
+    return os.path.join(directory or RECORDING_DIR, f"{brand.slug}.zip")
+
+
+def har_route_options(brand: BrandRecord, mode: str, directory: str = None) -> dict:
+    """
+    Arguments for BrowserContext.route_from_har to record or replay a session.
+    In record mode every response is written to the brand's archive when the
+    context closes. In replay mode responses are served from that archive
+    and anything that wasn't recorded is aborted, so nothing hits the network.
+    :param brand: the brand being scanned
+    :param mode: RECORD or REPLAY
+    :param directory: override for RECORDING_DIR
+    :return: dict of keyword arguments
+    """
+    path = recording_path(brand, directory)
+
+    if mode == RECORD:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return {"har": path, "update": True, "update_content": "attach"}
+
+    if mode == REPLAY:
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"No recording of {brand.name} at {path}")
+        return {"har": path, "not_found": "abort"}
+
+    raise ValueError(f"Unknown recording mode: {mode}")
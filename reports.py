@@ -0,0 +1,171 @@
+"""
+Read side of the price data, for reports and dashboards.
+Results are cached in memory until new prices are saved, by this process
+or any other, or for CACHE_TTL seconds, and are immutable as they are
+shared.
+"""
+import datetime
+from dataclasses import dataclass
+from decimal import Decimal
+from typing import Optional, Tuple
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from cache import cached, watch
+from database import db_engine
+from models.brand import Brand
+from models.product import Product
+from models.price import Price
+from models.daily_price import DailyPrice
+
+CACHE_TTL = 300
+
+# Scans run in other processes, so listen for them saving prices
+watch(db_engine)
+
+
+@dataclass(frozen=True)
+class PricePoint:
+    day: datetime.date
+    brand: str
+    prices: int
+    min_unit_price: int
+    max_unit_price: int
+    avg_unit_price: Decimal
+    min_price_per: int
+
+
+@dataclass(frozen=True)
+class CheapestPrice:
+    brand: str
+    title: str
+    unit_price: int
+    price_per: int
+    unit: str
+    url: str
+    screenshot_url: Optional[str]
+
+
+@dataclass(frozen=True)
+class BasketCost:
+    brand: str
+    # Sum of the cheapest price of each product the brand had
+    total: int
+    products: int
+    # Products in the group the brand had no price for
+    missing: int
+
+
+@cached(ttl=CACHE_TTL)
+def price_history(
+    product_id: int, days: int = 90, seller_id: int = None
+) -> Tuple[PricePoint, ...]:
+    """
+    Daily prices of a product, oldest first
+    :param product_id: the product
+    :param days: how far back to go
+    :param seller_id: just this brand, or None for every brand
+    """
+    since = datetime.date.today() - datetime.timedelta(days=days)
+    query = (
+        select(DailyPrice, Brand.name)
+        .join(Brand, Brand.id == DailyPrice.seller_id)
+        .where(DailyPrice.product_id == product_id, DailyPrice.day >= since)
+        .order_by(DailyPrice.day, Brand.name)
+    )
+    if seller_id is not None:
+        query = query.where(DailyPrice.seller_id == seller_id)
+
+    with Session(db_engine) as session:
+        return tuple(
+            PricePoint(
+                day=row.DailyPrice.day,
+                brand=row.name,
+                prices=row.DailyPrice.prices,
+                min_unit_price=row.DailyPrice.min_unit_price,
+                max_unit_price=row.DailyPrice.max_unit_price,
+                avg_unit_price=row.DailyPrice.avg_unit_price,
+                min_price_per=row.DailyPrice.min_price_per,
+            )
+            for row in session.execute(query)
+        )
+
+
+@cached(ttl=CACHE_TTL)
+def cheapest_on(product_id: int, day: datetime.date) -> Optional[CheapestPrice]:
+    """
+    The cheapest price recorded for a product on a day, at any brand
+    :return: None if there are no prices for it that day
+    """
+    query = (
+        select(Price, Brand.name)
+        .join(Brand, Brand.id == Price.seller_id)
+        .where(
+            Price.product_id == product_id,
+            Price.recorded_on == day,
+            Price.unit_price > 0,
+        )
+        .order_by(Price.unit_price, Price.price_per)
+        .limit(1)
+    )
+
+    with Session(db_engine) as session:
+        row = session.execute(query).first()
+        if row is None:
+            return None
+
+        return CheapestPrice(
+            brand=row.name,
+            title=row.Price.title,
+            unit_price=row.Price.unit_price,
+            price_per=row.Price.price_per,
+            unit=row.Price.unit,
+            url=row.Price.url,
+            screenshot_url=row.Price.screenshot_url,
+        )
+
+
+def cheapest_today(product_id: int) -> Optional[CheapestPrice]:
+    return cheapest_on(product_id, datetime.date.today())
+
+
+@cached(ttl=CACHE_TTL)
+def basket_cost_on(group_code: str, day: datetime.date) -> Tuple[BasketCost, ...]:
+    """
+    What buying the cheapest of each active product in a group cost at
+    each brand on a day, cheapest basket first. Brands with missing products
+    look cheaper than they are, so check missing before comparing.
+    :param group_code: the group
+    :param day: the day
+    """
+    in_group = (Product.group_code == group_code, Product.active == True)
+
+    query = (
+        select(
+            Brand.name,
+            func.sum(DailyPrice.min_unit_price).label("total"),
+            func.count().label("products"),
+        )
+        .join(Brand, Brand.id == DailyPrice.seller_id)
+        .join(Product, Product.id == DailyPrice.product_id)
+        .where(DailyPrice.day == day, *in_group)
+        .group_by(Brand.name)
+        .order_by("total")
+    )
+
+    with Session(db_engine) as session:
+        group_size = session.scalar(select(func.count(Product.id)).where(*in_group))
+        return tuple(
+            BasketCost(
+                brand=row.name,
+                total=row.total,
+                products=row.products,
+                missing=group_size - row.products,
+            )
+            for row in session.execute(query)
+        )
+
+
+def basket_cost(group_code: str) -> Tuple[BasketCost, ...]:
+    return basket_cost_on(group_code, datetime.date.today())
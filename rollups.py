@@ -0,0 +1,146 @@
+"""
+Keeps daily_prices, the per product, brand and day summary of prices, up
+to date. Scans refresh the rows they touch as each brand finishes. To
+rebuild the history, e.g. after adding the table, run
+
+    python rollups.py [--start 2023-01-01] [--end 2023-12-31]
+"""
+import argparse
+import datetime
+from typing import Iterable
+
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.engine import Engine
+
+from cache import bump_generation, notify_changed
+from database import db_engine
+
+# Every model has to be imported for the relationships between them to work
+import models.brand
+import models.product
+from models.price import Price
+from models.daily_price import DailyPrice
+from partitions import add_months
+
+SUMMARY_COLUMNS = (
+    "prices",
+    "min_unit_price",
+    "max_unit_price",
+    "avg_unit_price",
+    "min_price_per",
+    "max_price_per",
+    "avg_price_per",
+)
+
+
+def refresh_daily_prices(connection, *conditions) -> int:
+    """
+    Recalculate the daily_prices rows for the prices matching conditions.
+    Rows are recalculated from scratch rather than adjusted, so refreshing
+    the same prices twice is harmless.
+    :param connection: connection to run in, part of the caller's transaction
+    :param conditions: WHERE clauses on Price
+    :return: number of rows written
+    """
+    # A price of zero means the price couldn't be read, so it's left out
+    summary = (
+        select(
+            Price.product_id,
+            Price.seller_id,
+            Price.recorded_on,
+            func.count(),
+            func.min(Price.unit_price),
+            func.max(Price.unit_price),
+            func.avg(Price.unit_price),
+            func.min(Price.price_per),
+            func.max(Price.price_per),
+            func.avg(Price.price_per),
+        )
+        .where(Price.unit_price > 0, *conditions)
+        .group_by(Price.product_id, Price.seller_id, Price.recorded_on)
+    )
+
+    upsert = insert(DailyPrice).from_select(
+        ["product_id", "seller_id", "day", *SUMMARY_COLUMNS], summary
+    )
+    upsert = upsert.on_conflict_do_update(
+        index_elements=["product_id", "seller_id", "day"],
+        set_={column: upsert.excluded[column] for column in SUMMARY_COLUMNS},
+    )
+    return connection.execute(upsert).rowcount
+
+
+def update_daily_prices(engine: Engine, seller_id: int, touched: Iterable) -> int:
+    """
+    Refresh the summaries of the prices a brand's scan has just saved
+    :param engine: database to update
+    :param seller_id: the brand
+    :param touched: (product_id, day) pairs, see PriceWriter.touched
+    :return: number of rows written
+    """
+    touched = set(touched)
+    if not touched:
+        return 0
+
+    product_ids = sorted({product_id for product_id, _ in touched})
+    days = sorted({day for _, day in touched})
+    with engine.begin() as connection:
+        rows = refresh_daily_prices(
+            connection,
+            Price.seller_id == seller_id,
+            Price.product_id.in_(product_ids),
+            Price.recorded_on.in_(days),
+        )
+        notify_changed(connection)
+    bump_generation()
+    return rows
+
+
+def backfill(engine: Engine, start: datetime.date = None, end: datetime.date = None):
+    """
+    Rebuild daily_prices from start to end inclusive, a month at a time so
+    each transaction only reads one partition
+    :param engine: database to update
+    :param start: defaults to the first price
+    :param end: defaults to today
+    """
+    if start is None:
+        with engine.connect() as connection:
+            start = connection.execute(select(func.min(Price.recorded_on))).scalar()
+        if start is None:
+            print("No prices to roll up")
+            return
+
+    end = end or datetime.date.today()
+    month = start.replace(day=1)
+    while month <= end:
+        next_month = add_months(month, 1)
+        with engine.begin() as connection:
+            rows = refresh_daily_prices(
+                connection,
+                Price.recorded_on >= max(month, start),
+                Price.recorded_on < next_month,
+                Price.recorded_on <= end,
+            )
+        print(f" - {month:%b %Y}: {rows} daily prices")
+        month = next_month
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild the daily price rollup")
+    parser.add_argument(
+        "--start",
+        type=datetime.date.fromisoformat,
+        default=None,
+        help="first day to rebuild, defaults to the first price",
+    )
+    parser.add_argument(
+        "--end",
+        type=datetime.date.fromisoformat,
+        default=None,
+        help="last day to rebuild, defaults to today",
+    )
+    args = parser.parse_args()
+
+    backfill(db_engine, args.start, args.end)
@@ -0,0 +1,295 @@
+"""
+A queue of scan jobs, one per brand, product and day, which any number of
+workers on any number of machines can drain together.
+
+A run is planned once with plan_run, which is safe to repeat. Workers then
+claim jobs a batch at a time with SELECT ... FOR UPDATE SKIP LOCKED, so no
+two workers ever claim the same job, and keep them with a heartbeat. A job
+whose worker stops heartbeating, e.g. because it crashed, is reclaimed by
+the next worker to come looking. A job is only finished by the worker that
+holds it, so it's finished exactly once. Prices can't be saved twice
+either, see prices_seller_url_day_uindex, so a reclaimed job repeating
+some of the work costs time but never duplicates prices.
+"""
+import datetime
+import os
+import socket
+import threading
+from dataclasses import dataclass
+from typing import List
+
+from sqlalchemy import and_, func, or_, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.engine import Engine
+
+from catalogue import Catalogue
+from models.scan_job import ScanJob, PENDING, CLAIMED, DONE, FAILED
+
+
+def worker_name() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def plan_run(engine: Engine, catalogue: Catalogue, day: datetime.date = None) -> int:
+    """
+    Add a job for every brand and product in the catalogue, leaving alone
+    any that are already planned
+    :param engine: database to plan in
+    :param catalogue: what to scan
+    :param day: day the run is for, defaults to today
+    :return: number of jobs added
+    """
+    day = day or datetime.date.today()
+    rows = [
+        {"seller_id": brand.id, "product_id": product.id, "scan_date": day}
+        for brand in catalogue.brands
+        for product in catalogue.products
+    ]
+    if not rows:
+        return 0
+
+    with engine.begin() as connection:
+        result = connection.execute(insert(ScanJob).on_conflict_do_nothing(), rows)
+    return result.rowcount
+
+
+@dataclass(frozen=True)
+class ClaimedJob:
+    id: int
+    seller_id: int
+    product_id: int
+    attempts: int
+
+
+class JobQueue:
+    """
+    One worker's view of a day's jobs.
+    Claimed jobs are kept alive by a heartbeat thread, so a product taking a
+    long time to scan doesn't lose its job, but one from a crashed worker
+    is reclaimed after stale_seconds.
+    """
+
+    def __init__(
+        self,
+        engine: Engine,
+        day: datetime.date = None,
+        worker: str = None,
+        stale_seconds: float = 300,
+        max_attempts: int = 3,
+    ):
+        """
+        :param engine: database the jobs are in
+        :param day: day of the run to work on, defaults to today
+        :param worker: name to claim jobs under, defaults to host and pid
+        :param stale_seconds: reclaim jobs without a heartbeat for this long
+        :param max_attempts: give up on a job after this many claims
+        """
+        self.engine = engine
+        self.day = day or datetime.date.today()
+        self.worker = worker or worker_name()
+        self.stale_seconds = stale_seconds
+        self.max_attempts = max_attempts
+
+        self.claimed = set()
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.heartbeat_thread = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def stale_before(self):
+        return func.now() - datetime.timedelta(seconds=self.stale_seconds)
+
+    def claim(self, seller_id: int, limit: int = 10) -> List[ClaimedJob]:
+        """
+        Claim up to limit of a brand's jobs which are pending, or whose
+        worker has stopped heartbeating
+        :param seller_id: the brand
+        :param limit: max jobs to claim
+        :return: the jobs claimed, none if the brand has nothing left to do
+        """
+        claimable = (
+            select(ScanJob.id)
+            .where(
+                ScanJob.scan_date == self.day,
+                ScanJob.seller_id == seller_id,
+                ScanJob.attempts < self.max_attempts,
+                or_(
+                    ScanJob.state == PENDING,
+                    and_(
+                        ScanJob.state == CLAIMED,
+                        ScanJob.heartbeat_at < self.stale_before(),
+                    ),
+                ),
+            )
+            .order_by(ScanJob.product_id)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+            .scalar_subquery()
+        )
+        claim = (
+            update(ScanJob)
+            .where(ScanJob.id.in_(claimable))
+            .values(
+                state=CLAIMED,
+                attempts=ScanJob.attempts + 1,
+                claimed_by=self.worker,
+                claimed_at=func.now(),
+                heartbeat_at=func.now(),
+            )
+            .returning(
+                ScanJob.id, ScanJob.seller_id, ScanJob.product_id, ScanJob.attempts
+            )
+        )
+
+        with self.engine.begin() as connection:
+            self.abandon_stale(connection, seller_id)
+            jobs = [ClaimedJob(*row) for row in connection.execute(claim)]
+
+        with self.lock:
+            self.claimed.update(job.id for job in jobs)
+        if jobs and self.heartbeat_thread is None:
+            self.heartbeat_thread = threading.Thread(
+                target=self.heartbeat_loop, name="scan-job-heartbeat", daemon=True
+            )
+            self.heartbeat_thread.start()
+
+        return jobs
+
+    def abandon_stale(self, connection, seller_id: int):
+        # Stale jobs which have used up their attempts would otherwise stay
+        # claimed forever
+        connection.execute(
+            update(ScanJob)
+            .where(
+                ScanJob.scan_date == self.day,
+                ScanJob.seller_id == seller_id,
+                ScanJob.state == CLAIMED,
+                ScanJob.attempts >= self.max_attempts,
+                ScanJob.heartbeat_at < self.stale_before(),
+            )
+            .values(state=FAILED, finished_at=func.now(), error="Worker stopped")
+        )
+
+    def heartbeat(self) -> int:
+        """
+        Mark every job this worker holds as still being worked on
+        :return: number of jobs still held
+        """
+        with self.lock:
+            job_ids = list(self.claimed)
+        if not job_ids:
+            return 0
+
+        with self.engine.begin() as connection:
+            result = connection.execute(
+                update(ScanJob)
+                .where(
+                    ScanJob.id.in_(job_ids),
+                    ScanJob.state == CLAIMED,
+                    ScanJob.claimed_by == self.worker,
+                )
+                .values(heartbeat_at=func.now())
+            )
+        return result.rowcount
+
+    def heartbeat_loop(self):
+        # Often enough that a couple of missed beats don't lose the jobs
+        interval = self.stale_seconds / 3
+        while not self.stopped.wait(interval):
+            try:
+                self.heartbeat()
+            except Exception as e:
+                print(" * Scan job heartbeat failed")
+                print(f"     > {str(e)}")
+
+    def finish(
+        self, job: ClaimedJob, state: str, prices: int = None, error: str = None
+    ) -> bool:
+        """
+        Finish a job, if this worker still holds it
+        :return: False if the job was reclaimed by another worker, in which
+                 case it's theirs to finish
+        """
+        with self.lock:
+            self.claimed.discard(job.id)
+
+        with self.engine.begin() as connection:
+            result = connection.execute(
+                update(ScanJob)
+                .where(
+                    ScanJob.id == job.id,
+                    ScanJob.state == CLAIMED,
+                    ScanJob.claimed_by == self.worker,
+                    ScanJob.attempts == job.attempts,
+                )
+                .values(
+                    state=state,
+                    finished_at=None if state == PENDING else func.now(),
+                    prices=prices,
+                    error=error,
+                )
+            )
+
+        if result.rowcount == 0:
+            print(f" * Scan job {job.id} was reclaimed by another worker")
+            return False
+
+        return True
+
+    def complete(self, job: ClaimedJob, prices: int) -> bool:
+        return self.finish(job, DONE, prices=prices)
+
+    def fail(self, job: ClaimedJob, error: Exception) -> bool:
+        """
+        Put a job back to be tried again, or fail it once it has used up
+        its attempts
+        """
+        if job.attempts < self.max_attempts:
+            return self.finish(job, PENDING, error=str(error))
+
+        return self.finish(job, FAILED, error=str(error))
+
+    def release(self):
+        """
+        Hand back every job this worker holds without counting it as an
+        attempt, e.g. when its brand can't be scanned
+        """
+        with self.lock:
+            job_ids = list(self.claimed)
+            self.claimed.clear()
+        if not job_ids:
+            return
+
+        with self.engine.begin() as connection:
+            connection.execute(
+                update(ScanJob)
+                .where(
+                    ScanJob.id.in_(job_ids),
+                    ScanJob.state == CLAIMED,
+                    ScanJob.claimed_by == self.worker,
+                )
+                .values(state=PENDING, attempts=ScanJob.attempts - 1)
+            )
+
+    def progress(self) -> dict:
+        """
+        :return: number of the day's jobs in each state
+        """
+        with self.engine.connect() as connection:
+            rows = connection.execute(
+                select(ScanJob.state, func.count())
+                .where(ScanJob.scan_date == self.day)
+                .group_by(ScanJob.state)
+            )
+            return dict(rows.all())
+
+    def close(self):
+        self.stopped.set()
+        if self.heartbeat_thread is not None:
+            self.heartbeat_thread.join()
+            self.heartbeat_thread = None
@@ -0,0 +1,448 @@
+import asyncio
+import contextvars
+import datetime
+import io
+import math
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Optional
+from uuid import uuid4
+
+from PIL import Image, ImageDraw, ImageFont, ImageFilter
+
+from models.price import Price
+from file_storage import LocalStorage, StorageBackend, get_storage
+from metrics import timed
+
+FONT_PATH = os.path.join(os.getcwd(), "assets", "B612Mono-Regular.ttf")
+WATERMARK_PATH = os.path.join(os.getcwd(), "assets", "LogoIcon@2x.png")
+
+# Screenshots are shrunk to fit this before anything else is done to them.
+# Pillow antialiases when shrinking with any filter, and bilinear is about
+# twice as fast as the default Lanczos for no visible difference in text.
+OUTPUT_SIZE = (900, 750)
+OUTPUT_RESAMPLE = Image.Resampling.BILINEAR
+
+# Radius of the blur over product images, in screenshot pixels
+BLUR_RADIUS = 18
+
+# Regions smaller than this aren't worth clipping to, the footer wouldn't
+# fit, so the whole viewport is captured instead
+MIN_CLIP_SIZE = (300, 200)
+
+# Format name: (file extension, content type, default quality)
+FORMATS = {
+    "jpeg": ("jpg", "image/jpeg", 35),
+    "webp": ("webp", "image/webp", 50),
+}
+
+# Lowest quality a screenshot will be saved at to fit a byte budget
+MIN_QUALITY = 20
+
+# FreeType faces aren't safe to share between threads, so each worker
+# loads its own copy of the font
+_local = threading.local()
+
+
+def get_font() -> ImageFont.FreeTypeFont:
+    if not hasattr(_local, "font"):
+        _local.font = ImageFont.truetype(font=FONT_PATH, size=10)
+    return _local.font
+
+
+@lru_cache(maxsize=None)
+def load_watermark() -> Image.Image:
+    """
+    The watermark is only read once per process. Treat it as read only,
+    it is shared.
+    """
+    with Image.open(WATERMARK_PATH) as watermark:
+        return watermark.resize((41, 41))
+
+
+@lru_cache(maxsize=8)
+def footer_template(width: int) -> Image.Image:
+    """
+    The empty footer boxes for a screenshot of this width, pasted in at
+    (20, height - 55). Treat it as read only, it is shared.
+    """
+    footer = Image.new("RGB", (width - 39, 36), "#FFFFFF")
+    ImageDraw.Draw(footer).rectangle(((width - 170, 0), (width - 40, 35)), "#d6d6d6")
+    return footer
+
+
+def redaction_boxes(boxes, size: tuple, scale: float = 1) -> list:
+    """
+    Scale image bounding boxes, clip them to the screenshot and merge any
+    that overlap, so no part of the screenshot is blurred twice
+    :param boxes: Playwright bounding boxes
+    :param size: (width, height) of the screenshot
+    :param scale: how much the screenshot has been shrunk by
+    :return: list of (left, top, right, bottom) tuples
+    """
+    width, height = size
+    rects = []
+    for box in boxes:
+        left = max(math.floor(box["x"] * scale), 0)
+        top = max(math.floor(box["y"] * scale), 0)
+        right = min(math.ceil((box["x"] + box["width"]) * scale), width)
+        bottom = min(math.ceil((box["y"] + box["height"]) * scale), height)
+        if right > left and bottom > top:
+            rects.append((left, top, right, bottom))
+
+    merged = []
+    for rect in sorted(rects):
+        # Keep growing this one until it doesn't touch anything merged so far
+        i = 0
+        while i < len(merged):
+            other = merged[i]
+            if (
+                rect[0] < other[2]
+                and other[0] < rect[2]
+                and rect[1] < other[3]
+                and other[1] < rect[3]
+            ):
+                rect = (
+                    min(rect[0], other[0]),
+                    min(rect[1], other[1]),
+                    max(rect[2], other[2]),
+                    max(rect[3], other[3]),
+                )
+                merged.pop(i)
+                i = 0
+            else:
+                i += 1
+        merged.append(rect)
+
+    return merged
+
+
+def blur(image: Image.Image, rect: tuple, radius: float):
+    """
+    Blur part of an image in place.
+    Shrinking, blurring a little and growing it back looks much the same as
+    a Gaussian blur of the full radius, for a fraction of the work.
+    """
+    region = image.crop(rect)
+    factor = max(int(radius / 2), 1)
+    small = region.resize(
+        (max(region.width // factor, 1), max(region.height // factor, 1)),
+        Image.Resampling.BOX,
+    )
+    small = small.filter(ImageFilter.GaussianBlur(2))
+    image.paste(small.resize(region.size, Image.Resampling.BILINEAR), rect[:2])
+
+
+def clip_region(box: dict, viewport: dict) -> Optional[dict]:
+    """
+    The part of the viewport to capture for an element
+    :param box: bounding box of the element, can be None
+    :param viewport: {"width": ..., "height": ...} of the page, can be None
+    :return: clip for Page.screenshot, None to capture the whole viewport
+    """
+    if box is None or viewport is None:
+        return None
+
+    left, top = max(box["x"], 0), max(box["y"], 0)
+    right = min(box["x"] + box["width"], viewport["width"])
+    bottom = min(box["y"] + box["height"], viewport["height"])
+    if right - left < MIN_CLIP_SIZE[0] or bottom - top < MIN_CLIP_SIZE[1]:
+        return None
+
+    return {"x": left, "y": top, "width": right - left, "height": bottom - top}
+
+
+@dataclass(frozen=True)
+class OutputFormat:
+    """
+    How stamped screenshots are saved.
+    With a byte budget, the quality is stepped down until the screenshot
+    fits or MIN_QUALITY is reached.
+    """
+
+    format: str = "jpeg"
+    quality: int = None
+    max_bytes: int = None
+
+    def __post_init__(self):
+        if self.format not in FORMATS:
+            raise ValueError(f"Unknown screenshot format: {self.format}")
+
+    @property
+    def extension(self) -> str:
+        return FORMATS[self.format][0]
+
+    @property
+    def content_type(self) -> str:
+        return FORMATS[self.format][1]
+
+    def encode(self, image: Image.Image) -> io.BytesIO:
+        # Firefox captures PNGs with an alpha channel, which JPEG can't hold,
+        # and a screenshot has nothing to see through anyway
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+
+        quality = self.quality or FORMATS[self.format][2]
+        while True:
+            encoded = io.BytesIO()
+            image.save(encoded, format=self.format, quality=quality)
+            if (
+                self.max_bytes is None
+                or encoded.tell() <= self.max_bytes
+                or quality <= MIN_QUALITY
+            ):
+                return encoded
+
+            quality = max(quality - 10, MIN_QUALITY)
+
+
+def screenshot_storage(directory: str = None) -> StorageBackend:
+    """
+    :param directory: save screenshots here rather than the default storage
+    """
+    if directory is not None:
+        return LocalStorage(directory)
+    return get_storage()
+
+
+@dataclass(frozen=True)
+class ScreenshotJob:
+    """
+    Everything needed to stamp a screenshot, copied off the Price.
+    The scan carries on filling in the Price while the screenshot is
+    stamped, and apply_completed sets its screenshot_url on the scan's
+    thread, so the workers get a frozen copy rather than sharing it.
+    """
+
+    image: bytes
+    boxes: tuple
+    url: str
+    recorded_at: datetime.datetime
+    unit_price: int
+    price_per: int
+    unit: str
+
+    @classmethod
+    def for_price(
+        cls, price: Price, image: bytes, boxes: list, clip: dict = None
+    ) -> "ScreenshotJob":
+        """
+        :param price: the price the screenshot is evidence for
+        :param image: the raw screenshot
+        :param boxes: bounding boxes of the images on the page
+        :param clip: the part of the page the screenshot was clipped to
+        """
+        # Boxes are relative to the viewport, make them relative to the image
+        x, y = (clip["x"], clip["y"]) if clip else (0, 0)
+        return cls(
+            image=image,
+            boxes=tuple(
+                {**box, "x": box["x"] - x, "y": box["y"] - y}
+                for box in boxes or []
+                if box is not None
+            ),
+            url=price.url,
+            recorded_at=price.recorded_at,
+            unit_price=price.unit_price,
+            price_per=price.price_per,
+            unit=price.unit,
+        )
+
+
+@timed("stamp_screenshot")
+def stamp_screenshot(
+    job: ScreenshotJob, watermark: Image.Image = None, output: OutputFormat = None
+) -> io.BytesIO:
+    """
+    Blur the product images out of a screenshot and stamp it with the price
+    :param job: the raw screenshot and the price it is evidence for
+    :param watermark: defaults to load_watermark()
+    :param output: defaults to JPEG
+    :return: BytesIO containing the stamped image
+    """
+    watermark = watermark or load_watermark()
+    output = output or OutputFormat()
+    font = get_font()
+
+    with Image.open(io.BytesIO(job.image)) as screenshot:
+        # Shrink first, so everything else works on as few pixels as possible.
+        # For a JPEG this also lets the decoder skip detail that isn't needed.
+        original_width = screenshot.width
+        screenshot.thumbnail(OUTPUT_SIZE, resample=OUTPUT_RESAMPLE)
+        scale = screenshot.width / original_width
+
+        # Cover images
+        for rect in redaction_boxes(job.boxes, screenshot.size, scale):
+            blur(screenshot, rect, BLUR_RADIUS * scale)
+
+        screenshot.paste(watermark, (20, 20), mask=watermark)
+
+        width, height = screenshot.width, screenshot.height
+        screenshot.paste(footer_template(width), (20, height - 55))
+        renderer = ImageDraw.Draw(screenshot)
+        renderer.text(
+            (25, height - 40),
+            job.url,
+            anchor="ls",
+            fill="#000000",
+            font=font,
+        )
+
+        timestamp = job.recorded_at.strftime("%d/%b/%Y (%a) %X")
+        renderer.text(
+            (25, height - 25),
+            timestamp,
+            anchor="ls",
+            fill="#000000",
+            font=font,
+        )
+
+        price_str = job.unit_price / 100
+        renderer.text(
+            (width - 25, height - 40),
+            f"£{price_str:.2f}",
+            anchor="rs",
+            fill="#000000",
+            font=font,
+        )
+
+        per_price = job.price_per / 100
+        renderer.text(
+            (width - 25, height - 25),
+            f"£{per_price:.2f} / {job.unit}",
+            anchor="rs",
+            fill="#000000",
+            font=font,
+        )
+
+        return output.encode(screenshot)
+
+
+class ScreenshotPipeline:
+    """
+    Stamps and uploads screenshots on background threads, so the browser
+    can move on to the next page instead of waiting for PIL and S3.
+    At most max_pending screenshots are held at once. Submitting another
+    blocks until one has finished, so slow uploads slow the scan down
+    rather than filling up memory.
+    Screenshot URLs are only written to their Price by apply_completed(),
+    which must be called from the thread that owns the Price's session.
+    """
+
+    def __init__(
+        self,
+        workers: int = 2,
+        max_pending: int = 8,
+        storage: StorageBackend = None,
+        output: OutputFormat = None,
+    ):
+        """
+        :param workers: number of threads stamping and uploading
+        :param max_pending: max screenshots queued or in progress
+        :param storage: where to save screenshots, defaults to get_storage()
+        :param output: how to save screenshots, defaults to JPEG
+        """
+        self.storage = storage or get_storage()
+        self.output = output or OutputFormat()
+        self.watermark = load_watermark()
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="screenshots"
+        )
+        self.max_pending = max_pending
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.async_slots = None
+        self.pending = {}
+        self.failures = 0
+
+    def process(self, job: ScreenshotJob) -> str:
+        """
+        Stamp and save one screenshot. Runs on a worker thread.
+        :return: public URL of the saved screenshot
+        """
+        stamped = stamp_screenshot(job, self.watermark, self.output)
+        return self.storage.save(
+            name=f"{uuid4()}.{self.output.extension}",
+            file=stamped,
+            content_type=self.output.content_type,
+        )
+
+    def submit(
+        self, price: Price, image: bytes, boxes: list, clip: dict = None
+    ) -> Future:
+        """
+        Queue a screenshot to be stamped and saved, blocking if the queue is full
+        :param price: the price the screenshot is evidence for
+        :param image: the raw screenshot
+        :param boxes: bounding boxes of the images on the page
+        :param clip: the part of the page the screenshot was clipped to
+        :return: Future of the screenshot's URL
+        """
+        job = ScreenshotJob.for_price(price, image, boxes, clip)
+
+        # The worker times it as part of the brand that's being scanned
+        context = contextvars.copy_context()
+        self.slots.acquire()
+        try:
+            future = self.executor.submit(context.run, self.process, job)
+        except BaseException:
+            self.slots.release()
+            raise
+
+        self.pending[future] = price
+        future.add_done_callback(lambda _: self.slots.release())
+        return future
+
+    def apply_completed(self, wait: bool = False) -> int:
+        """
+        Write the URLs of finished screenshots to their prices
+        :param wait: wait for every pending screenshot first
+        :return: number of prices updated
+        """
+        updated = 0
+        for future in list(self.pending):
+            if not wait and not future.done():
+                continue
+
+            price = self.pending.pop(future)
+            try:
+                price.screenshot_url = future.result()
+                updated += 1
+            except Exception as e:
+                self.failed(price, e)
+
+        return updated
+
+    def failed(self, price: Price, error: Exception):
+        self.failures += 1
+        print(f" * Couldn't save screenshot of {price.url}")
+        print(f"     > {str(error)}")
+
+    async def async_submit(
+        self, price: Price, image: bytes, boxes: list, clip: dict = None
+    ):
+        """
+        Stamp and save a screenshot without blocking the event loop, and
+        write its URL to the price. Waits for a slot if the queue is full.
+        """
+        if self.async_slots is None:
+            self.async_slots = asyncio.Semaphore(self.max_pending)
+
+        job = ScreenshotJob.for_price(price, image, boxes, clip)
+        async with self.async_slots:
+            loop = asyncio.get_running_loop()
+            try:
+                price.screenshot_url = await loop.run_in_executor(
+                    self.executor, contextvars.copy_context().run, self.process, job
+                )
+            except Exception as e:
+                self.failed(price, e)
+
+    def close(self):
+        """
+        Wait for every pending screenshot and stop the workers
+        """
+        self.apply_completed(wait=True)
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,34 @@
+import os
+import time
+
+from browser_profiles import CONSENT_MARKER, has_consent, save_consent
+
+
+def cookie(name, value="1", expires=-1, domain=".shop.co.uk") -> dict:
+    return {"name": name, "value": value, "domain": domain, "expires": expires}
+
+
+def test_consent_lasts_as_long_as_its_cookies(tmp_path):
+    profile = str(tmp_path)
+    session = cookie("session", "abc")
+    before = [session, cookie("consent", "pending")]
+    after = [session, cookie("consent", "all", time.time() + 3600)]
+    assert not has_consent(profile, before)
+
+    save_consent(profile, before, after)
+    assert has_consent(profile, after)
+    # Only the cookie accepting it changed has to still be there
+    assert has_consent(profile, [cookie("consent", "all")])
+
+    # Cleared, or expired
+    assert not has_consent(profile, [session])
+    assert not has_consent(profile, [session, cookie("consent", "all", 1)])
+
+
+def test_no_consent_without_a_profile_or_marker(tmp_path):
+    assert not has_consent(None, [cookie("consent")])
+    assert not has_consent(str(tmp_path), [cookie("consent")])
+
+    # Markers from before consent cookies were recorded are empty
+    open(os.path.join(tmp_path, CONSENT_MARKER), "w").close()
+    assert not has_consent(str(tmp_path), [cookie("consent")])
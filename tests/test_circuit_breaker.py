@@ -0,0 +1,90 @@
+from types import SimpleNamespace
+
+import pytest
+
+import circuit_breaker
+from circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(circuit_breaker, "time", SimpleNamespace(monotonic=clock))
+    return clock
+
+
+def tripped(clock, threshold: int = 3) -> CircuitBreaker:
+    breaker = CircuitBreaker(threshold=threshold, reset_seconds=60, max_trips=3)
+    for _ in range(threshold):
+        assert breaker.allow()
+        breaker.failed()
+    return breaker
+
+
+def test_closed_open_half_open_closed(clock):
+    breaker = CircuitBreaker(threshold=3, reset_seconds=60)
+    breaker.failed()
+    breaker.failed()
+    breaker.succeeded()
+    breaker.failed()
+    breaker.failed()
+    assert breaker.state == CLOSED and breaker.allow()
+
+    breaker.failed()
+    assert breaker.state == OPEN and breaker.trips == 1
+    assert not breaker.allow()
+    assert breaker.retry_in() == 60
+
+    clock.now += 60
+    assert breaker.state == HALF_OPEN
+    # Only one product is let through to try the site
+    assert breaker.allow()
+    assert not breaker.allow()
+
+    breaker.succeeded()
+    assert breaker.state == CLOSED and breaker.allow()
+
+
+def test_failed_trial_opens_it_again(clock):
+    breaker = tripped(clock)
+    clock.now += 60
+    assert breaker.allow()
+
+    breaker.failed()
+    assert breaker.state == OPEN and breaker.trips == 2
+    assert breaker.retry_in() == 60
+
+
+def test_late_outcomes_while_open_are_ignored(clock):
+    breaker = tripped(clock)
+
+    # Products which were under way when it opened finish afterwards
+    breaker.succeeded()
+    breaker.failed()
+    assert breaker.state == OPEN and breaker.trips == 1
+    assert breaker.retry_in() == 60
+
+    clock.now += 60
+    breaker.succeeded()
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow()
+
+
+def test_gives_up_after_max_trips(clock):
+    breaker = tripped(clock)
+    for _ in range(2):
+        clock.now += 60
+        assert breaker.allow()
+        breaker.failed()
+
+    assert breaker.given_up and breaker.trips == 3
+    clock.now += 600
+    assert breaker.state == OPEN and not breaker.allow()
@@ -0,0 +1,80 @@
+from catalogue import BrandRecord
+from network_rules import FIREFOX_BLOCKING_PREFS, NetworkFilter
+
+
+class StubContext:
+    def __init__(self):
+        self.routes = []
+        self.handlers = []
+
+    def route(self, url, handler):
+        self.routes.append((url, handler))
+
+    def on(self, event, handler):
+        self.handlers.append((event, handler))
+
+
+class StubRequest:
+    def __init__(self, url, resource_type):
+        self.url = url
+        self.resource_type = resource_type
+
+
+class StubRoute:
+    def __init__(self, url, resource_type):
+        self.request = StubRequest(url, resource_type)
+        self.outcome = None
+
+    def abort(self):
+        self.outcome = "abort"
+
+    def fallback(self):
+        self.outcome = "fallback"
+
+
+def shop(network_rules=None) -> BrandRecord:
+    return BrandRecord(
+        id=1,
+        name="Shop",
+        start_url="https://www.shop.co.uk",
+        wait_method="LOAD",
+        class_name="",
+        network_rules=network_rules,
+    )
+
+
+def test_persistent_profile_still_routes():
+    network_filter = NetworkFilter(shop({"deny": ["ads.example"]}), persistent=True)
+    context = StubContext()
+    network_filter.attach(context)
+
+    assert context.routes == [("**/*", network_filter.route)]
+    assert network_filter.firefox_user_prefs() == {}
+
+    (_, handler) = context.routes[0]
+    denied = StubRoute("https://ads.example/pixel.js", "script")
+    allowed = StubRoute("https://www.shop.co.uk/app.js", "script")
+    handler(denied)
+    handler(allowed)
+    assert (denied.outcome, allowed.outcome) == ("abort", "fallback")
+    assert network_filter.blocked == {"script": 1}
+
+
+def test_route_off_uses_firefox_blocking(capsys):
+    network_filter = NetworkFilter(
+        shop({"route": False, "deny": ["ads.example"]}), persistent=True
+    )
+    context = StubContext()
+    network_filter.attach(context)
+
+    assert context.routes == []
+    assert network_filter.firefox_user_prefs() == FIREFOX_BLOCKING_PREFS
+    assert "rules aren't applied: deny" in capsys.readouterr().out
+
+
+def test_route_off_without_rules_only_warns_without_a_profile(capsys):
+    NetworkFilter(shop({"route": False}), persistent=True)
+    assert capsys.readouterr().out == ""
+
+    NetworkFilter(shop({"route": False}), persistent=False)
+    assert "no cache to keep" in capsys.readouterr().out
@@ -0,0 +1,118 @@
+"""
+Checks of PriceWriter against a real Postgres, as it relies on ON CONFLICT
+and RETURNING. Skipped unless SNIFFER_TEST_DB_URL points at a scratch
+database, see test_scan_jobs.py.
+"""
+import datetime
+import os
+
+import pytest
+from sqlalchemy import create_engine, text
+
+from models.price import Price
+from price_writer import PriceWriter
+
+# Every model has to be imported for the relationships between them to work
+import models.brand
+import models.product
+
+DB_URL = os.environ.get("SNIFFER_TEST_DB_URL")
+SCHEMA = "sniffer_test_price_writer"
+RECORDED_AT = datetime.datetime(2024, 1, 1, 12)
+
+pytestmark = pytest.mark.skipif(DB_URL is None, reason="SNIFFER_TEST_DB_URL not set")
+
+
+@pytest.fixture
+def engine():
+    engine = create_engine(DB_URL, connect_args={"options": f"-csearch_path={SCHEMA}"})
+    with engine.begin() as connection:
+        connection.execute(text(f"drop schema if exists {SCHEMA} cascade"))
+        connection.execute(text(f"create schema {SCHEMA}"))
+        # The columns and unique index PriceWriter relies on, unpartitioned
+        connection.execute(
+            text(
+                """
+                create table prices
+                (
+                    id             bigserial primary key,
+                    seller_id      integer       not null,
+                    product_id     integer       not null,
+                    title          text          not null,
+                    recorded_at    timestamp     not null,
+                    recorded_on    date          not null,
+                    unit_price     integer       not null,
+                    price_per      integer       not null,
+                    unit           varchar(3)    not null,
+                    screenshot_url varchar(1024),
+                    url            varchar(1024) not null
+                )
+                """
+            )
+        )
+        connection.execute(
+            text(
+                "create unique index prices_seller_url_day_uindex "
+                "on prices (seller_id, url, recorded_on)"
+            )
+        )
+    yield engine
+
+    with engine.begin() as connection:
+        connection.execute(text(f"drop schema {SCHEMA} cascade"))
+    engine.dispose()
+
+
+def price(product_id: int, number: int, unit: str = "kg") -> Price:
+    return Price(
+        seller_id=1,
+        product_id=product_id,
+        title=f"Product {product_id}",
+        recorded_at=RECORDED_AT,
+        unit_price=100,
+        price_per=1000,
+        unit=unit,
+        url=f"https://shop/{product_id}/{number}",
+    )
+
+
+def saved(engine) -> list:
+    with engine.connect() as connection:
+        return connection.execute(
+            text("select product_id, url from prices order by url")
+        ).all()
+
+
+def test_bad_row_only_loses_its_product(engine):
+    writer = PriceWriter(engine)
+    writer.add("first", [price(1, 1), price(1, 2)])
+    # Too long for the unit column, which fails the whole batch
+    writer.add("second", [price(2, 1), price(2, 2, unit="kilo")])
+    writer.add("third", [price(3, 1)])
+
+    assert writer.flush() == 3
+    assert writer.failed == ["second"]
+    assert [product_id for product_id, _ in saved(engine)] == [1, 1, 3]
+    assert writer.touched == {(1, RECORDED_AT.date()), (3, RECORDED_AT.date())}
+
+
+def test_counts_rows_saved_across_statements(engine):
+    writer = PriceWriter(engine, batch_size=5000)
+    writer.add("first", [price(1, number) for number in range(500)])
+    assert writer.flush() == 500
+
+    # More rows than fit in one statement, some of which are already saved
+    writer.add("again", [price(1, number) for number in range(2500)])
+    assert writer.flush() == 2000
+    assert writer.written == 2500
+    assert len(saved(engine)) == 2500
+
+
+def test_flush_if_due(engine):
+    writer = PriceWriter(engine, flush_seconds=60)
+    writer.add("first", [price(1, 1)])
+    assert writer.flush_if_due() == 0
+
+    writer.oldest -= 60
+    assert writer.flush_if_due() == 1
+    assert writer.pending == []
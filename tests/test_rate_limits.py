@@ -0,0 +1,62 @@
+from catalogue import BrandRecord
+from rate_limits import RateLimiter
+
+
+class StubFrame:
+    def __init__(self, parent_frame=None):
+        self.parent_frame = parent_frame
+
+
+class StubRequest:
+    def __init__(self, navigation: bool):
+        self.navigation = navigation
+
+    def is_navigation_request(self) -> bool:
+        return self.navigation
+
+
+class StubResponse:
+    def __init__(self, url, status=429, navigation=True, frame=None):
+        self.url = url
+        self.status = status
+        self.request = StubRequest(navigation)
+        self.frame = frame or StubFrame()
+
+
+def limiter() -> RateLimiter:
+    brand = BrandRecord(
+        id=1,
+        name="Shop",
+        start_url="https://www.shop.co.uk",
+        wait_method="LOAD",
+        class_name="",
+        rate_limits={"cooldown_seconds": 0},
+    )
+    return RateLimiter(brand, max_concurrency=4)
+
+
+def test_slows_down_for_the_brands_own_pages():
+    rate_limiter = limiter()
+    rate_limiter.on_response(StubResponse("https://www.shop.co.uk/search?q=milk"))
+    rate_limiter.on_response(StubResponse("https://groceries.shop.co.uk/", 503))
+    assert rate_limiter.slowdowns == 2
+    assert rate_limiter.bucket.rate == 0.25
+
+
+def test_ignores_other_frames_and_requests():
+    rate_limiter = limiter()
+    main_frame = StubFrame()
+    for response in (
+        # An ad or consent frame, even one on the brand's own site
+        StubResponse("https://ads.example.com/frame", frame=StubFrame(main_frame)),
+        StubResponse("https://www.shop.co.uk/consent", frame=StubFrame(main_frame)),
+        # Somebody else's site in the main frame, e.g. a sign in redirect
+        StubResponse("https://login.example.com/"),
+        # Not a page load
+        StubResponse("https://www.shop.co.uk/api/prices", navigation=False),
+        StubResponse("https://www.shop.co.uk/", status=200),
+    ):
+        rate_limiter.on_response(response)
+
+    assert rate_limiter.slowdowns == 0
+    assert rate_limiter.bucket.rate == 1.0
@@ -0,0 +1,141 @@
+"""
+Checks of the scan_jobs queue against a real Postgres, as SKIP LOCKED and
+the heartbeats can't be faked. Skipped unless SNIFFER_TEST_DB_URL points
+at a scratch database, e.g.
+
+    SNIFFER_TEST_DB_URL=postgresql://postgres@localhost/scratch \
+        python -m pytest tests/test_scan_jobs.py
+
+Everything happens in its own schema, which is dropped and recreated for
+every test.
+"""
+import datetime
+import os
+
+import pytest
+from sqlalchemy import create_engine, text
+
+from catalogue import BrandRecord, Catalogue, ProductRecord
+from models.scan_job import CLAIMED, DONE, PENDING
+from scan_jobs import JobQueue, plan_run
+
+DB_URL = os.environ.get("SNIFFER_TEST_DB_URL")
+SCHEMA = "sniffer_test_scan_jobs"
+MIGRATION = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "migrations",
+    "008_scan_jobs.sql",
+)
+DAY = datetime.date(2024, 1, 1)
+BRAND = BrandRecord(
+    id=1, name="Shop", start_url="https://shop", wait_method="LOAD", class_name=""
+)
+PRODUCTS = tuple(
+    ProductRecord(
+        id=i,
+        name=f"Product {i}",
+        search_term=f"product {i}",
+        group_code="G",
+        group_name="Group",
+        is_food=True,
+    )
+    for i in range(1, 5)
+)
+
+pytestmark = pytest.mark.skipif(DB_URL is None, reason="SNIFFER_TEST_DB_URL not set")
+
+
+@pytest.fixture
+def engine():
+    engine = create_engine(DB_URL, connect_args={"options": f"-csearch_path={SCHEMA}"})
+    with open(MIGRATION) as f:
+        migration = f.read()
+    with engine.begin() as connection:
+        connection.execute(text(f"drop schema if exists {SCHEMA} cascade"))
+        connection.execute(text(f"create schema {SCHEMA}"))
+        # Just enough of the rest of the schema for the foreign keys
+        connection.execute(text("create table brands (id integer primary key)"))
+        connection.execute(text("create table products (id integer primary key)"))
+        connection.execute(text("insert into brands values (1)"))
+        connection.execute(text("insert into products values (1), (2), (3), (4)"))
+        connection.exec_driver_sql(migration)
+
+    plan_run(engine, Catalogue(brands=(BRAND,), products=PRODUCTS), DAY)
+    yield engine
+
+    with engine.begin() as connection:
+        connection.execute(text(f"drop schema {SCHEMA} cascade"))
+    engine.dispose()
+
+
+@pytest.fixture
+def queues(engine):
+    first = JobQueue(engine, DAY, worker="first")
+    second = JobQueue(engine, DAY, worker="second")
+    yield first, second
+    first.close()
+    second.close()
+
+
+def job_row(engine, job_id: int):
+    with engine.connect() as connection:
+        return connection.execute(
+            text("select state, attempts, claimed_by from scan_jobs where id = :id"),
+            {"id": job_id},
+        ).one()
+
+
+def test_claims_skip_locked_jobs(engine, queues):
+    first, second = queues
+
+    claimed = first.claim(BRAND.id, limit=2)
+    assert [job.product_id for job in claimed] == [1, 2]
+
+    # A job locked by a claim that's still in progress is skipped, not waited on
+    with engine.connect() as connection, connection.begin():
+        connection.execute(
+            text("select id from scan_jobs where product_id = 3 for update")
+        )
+        assert [job.product_id for job in second.claim(BRAND.id, limit=4)] == [4]
+
+    assert [job.product_id for job in second.claim(BRAND.id, limit=4)] == [3]
+    assert first.claim(BRAND.id) == []
+
+
+def test_reclaims_stale_jobs(engine, queues):
+    first, second = queues
+    (job,) = first.claim(BRAND.id, limit=1)
+    others = second.claim(BRAND.id, limit=4)
+    assert len(others) == 3 and job.id not in {other.id for other in others}
+
+    # The first worker stops heartbeating
+    with engine.begin() as connection:
+        connection.execute(
+            text(
+                "update scan_jobs set heartbeat_at = now() - interval '1 hour' "
+                "where id = :id"
+            ),
+            {"id": job.id},
+        )
+
+    (reclaimed,) = second.claim(BRAND.id, limit=4)
+    assert reclaimed.id == job.id
+    assert reclaimed.attempts == 2
+    assert job_row(engine, job.id) == (CLAIMED, 2, "second")
+
+    # Only the worker holding the job can finish it
+    assert first.complete(job, prices=3) is False
+    assert job_row(engine, job.id) == (CLAIMED, 2, "second")
+    assert second.complete(reclaimed, prices=3) is True
+    assert job_row(engine, job.id) == (DONE, 2, "second")
+
+
+def test_release_does_not_count_an_attempt(engine, queues):
+    first, _ = queues
+    jobs = first.claim(BRAND.id, limit=2)
+    assert all(job_row(engine, job.id)[:2] == (CLAIMED, 1) for job in jobs)
+
+    first.release()
+    for job in jobs:
+        assert job_row(engine, job.id)[:2] == (PENDING, 0)
+    assert [job.attempts for job in first.claim(BRAND.id, limit=2)] == [1, 1]